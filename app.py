@@ -4,19 +4,43 @@
 
 import os
 import io
+import re
 import uuid
-from datetime import datetime
-from typing import List, Optional
-
+import json
+import hashlib
+import gzip
+import shutil
+import time
+import tempfile
+import threading
+import itertools
+import sqlite3
+from collections import OrderedDict
+from functools import cmp_to_key
+from contextlib import closing
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Set, Tuple
+
+import numpy as np
 import pandas as pd
 import streamlit as st
 
 # --------------------------- CONFIG ---------------------------
 
 APP_TITLE = "OpperWorks Stock Take"
-DEFAULT_DATA_PATH = "data/inventory.csv"
-BACKUP_DIR = "backups"
-SNAPSHOT_DIR = "snapshots"
+# Persistent storage root (Render disk); when set, the inventory defaults to a SQLite database there
+DATA_ROOT = os.environ.get("OPP_DATA_ROOT", "")
+DEFAULT_DATA_PATH = os.path.join(DATA_ROOT, "data", "inventory.db") if DATA_ROOT else "data/inventory.csv"
+BACKUP_DIR = os.path.join(DATA_ROOT, "backups")
+SNAPSHOT_DIR = os.path.join(DATA_ROOT, "snapshots")
+# Gzip backups in a background thread after copying (set OPP_BACKUP_GZIP=1)
+BACKUP_GZIP = os.environ.get("OPP_BACKUP_GZIP", "0") == "1"
+# Journal saves: append row-level changes next to the data file instead of rewriting it
+# (default for the sidebar toggle via OPP_JOURNAL=1). The journal is compacted into the base
+# file once it grows past JOURNAL_COMPACT_RATIO x the base file size.
+JOURNAL_DEFAULT = os.environ.get("OPP_JOURNAL", "0") == "1"
+JOURNAL_SUFFIX = ".journal.jsonl"
+JOURNAL_COMPACT_RATIO = 0.5
 
 # Known logo locations (first existing will be used)
 OPPERWORKS_LOGO_CANDIDATES: List[str] = [
@@ -52,9 +76,71 @@ DELETE_COL = "Delete?"
 INT_COLS = ["Qty On Hand", "Min Level", "Max Level"]
 FLOAT_COLS = ["Unit Cost (ZAR)"]
 STRING_COLS = ["Item ID", "Item Code", "Description", "Category", "UOM", "Location", "Last Updated"]
+# Low-cardinality text columns kept as pandas categoricals with sorted categories (set OPP_CATEGORICAL=0
+# for plain strings): far less memory, and isin filters, option lists and sorts work on integer codes
+CATEGORICAL_COLS = ["Category", "Location", "UOM"]
+CATEGORICAL_TEXT = os.environ.get("OPP_CATEGORICAL", "1") == "1"
 
 DEFAULT_SORT = ["Category", "Item Code"]  # can be changed in UI
 
+# Bump whenever coerce_schema's output changes, so cached frames from older code are not reused
+SCHEMA_VERSION = 2
+# Process-wide inventory cache shared by all sessions (LRU by entry count and approximate memory)
+CACHE_MAX_ENTRIES = 8
+CACHE_MAX_BYTES = int(os.environ.get("OPP_CACHE_MB", "256")) * 1024 * 1024
+# Process-wide memo of derived results (views, option lists, metrics, exports) keyed by data version
+MEMO_MAX_ENTRIES = 256
+MEMO_MAX_BYTES = int(os.environ.get("OPP_MEMO_MB", "128")) * 1024 * 1024
+
+# Facet filters (multiselects with live, cross-filtered row counts)
+FACET_COLS = ["Category", "Location", "UOM"]
+# The header metrics are also broken down per value of these columns
+METRIC_GROUPS = ["Category", "Location"]
+# Filter widget keys and their cleared values (🔁 Clear Filters)
+FILTER_DEFAULTS = {
+    **{f"facet_{col}": [] for col in FACET_COLS},
+    "filter_search": "",
+    "filter_fuzzy": False,
+    "filter_qty_lo": None,
+    "filter_qty_hi": None,
+    "filter_cost_lo": None,
+    "filter_cost_hi": None,
+    "filter_stock": "Any",
+    "filter_stale_days": None,
+}
+
+# Fuzzy search: vocabulary tokens at least this similar to a query token count as a match, and rows
+# need at least this average best-match similarity over the query's tokens
+FUZZY_MIN_SIMILARITY = 0.4
+FUZZY_MIN_SCORE = 0.5
+
+# Default autosave debounce: write once edits have been quiet this long (changeable in UI)
+AUTOSAVE_DELAY_S = 2.0
+
+# Typed columnar backends (chosen by file extension); everything else that isn't .xlsx is CSV
+PARQUET_EXTS = (".parquet", ".pq")
+FEATHER_EXTS = (".feather", ".arrow")
+SQLITE_EXTS = (".db", ".sqlite", ".sqlite3")
+SQLITE_TABLE = "inventory"
+# Indexed columns of the SQLite inventory table (in addition to the _row_id primary key)
+SQLITE_INDEXED = ["Category", "Location", "UOM", "Item Code"]
+
+# Excel export: rows are converted from the frame and streamed into the workbook this many at a time
+EXPORT_CHUNK_ROWS = 10_000
+
+# data_editor widget key; its session_state entry holds the edited/added/deleted row delta
+EDITOR_KEY = "inventory_editor_v2"
+# Editor paging: rows per page choices (0 = all rows on one page) and the default
+EDITOR_PAGE_SIZES = [100, 250, 500, 1000, 5000, 0]
+EDITOR_PAGE_SIZE = 500
+# Read-only editor columns (sent dictionary-encoded) and the columns hidden from the editor by default
+EDITOR_READONLY = ["Last Updated"]
+EDITOR_HIDDEN = [ROW_ID_COL]
+
+# Page fragments (st.fragment keys) that rerun on their own; callbacks that change the inventory
+# data rerun all of these, anything else only reruns the fragment it belongs to
+DATA_FRAGMENTS = ["metrics", "breakdown", "inventory"]
+
 # ------------------------ UTILITIES ---------------------------
 
 def ensure_dirs():
@@ -71,120 +157,1445 @@ def find_first_existing(paths: List[str]) -> Optional[str]:
 def ts_now() -> str:
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-def coerce_schema(df: pd.DataFrame) -> pd.DataFrame:
-    """Ensure required columns exist and dtypes are sane. Keep any extra columns present in file."""
-    df = df.copy()
+def new_row_ids(n: int, existing: Optional[pd.Series] = None) -> List[str]:
+    """
+    Allocate 'n' fresh row ids in bulk: one random uuid4 prefix per batch plus a zero-padded counter,
+    giving the same 'opw_' + 32 hex-char shape as before. The batch is re-drawn on the (astronomically
+    unlikely) chance that it collides with an existing id.
+    """
+    if n <= 0:
+        return []
+    counter = pd.Series(range(n)).astype(str).str.zfill(8)
+    while True:
+        ids = ("opw_" + uuid.uuid4().hex[:24]) + counter
+        if existing is None or not ids.isin(existing).any():
+            return ids.tolist()
+
+def is_categorical_col(col: str) -> bool:
+    return CATEGORICAL_TEXT and col in CATEGORICAL_COLS
+
+def as_categorical_dtype(s: pd.Series) -> pd.CategoricalDtype:
+    """Categorical dtype over the values of 's', as sorted 'string' categories."""
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        categories = s.cat.categories
+    else:
+        categories = pd.Index(s.dropna().unique()).sort_values()
+    return pd.CategoricalDtype(categories.astype("string"))
+
+def as_categorical(s: pd.Series) -> pd.Series:
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        # Same codes, only the categories' dtype changes
+        return s.cat.rename_categories(as_categorical_dtype(s).categories)
+    return s.astype(as_categorical_dtype(s))
+
+def unify_categories(*frames: pd.DataFrame) -> List[pd.DataFrame]:
+    """
+    Give every categorical column one shared, sorted category set across 'frames' (extended by the
+    other frames' values), so concatenating them or assigning rows between them stays categorical.
+    """
+    frames = list(frames)
+    for col in CATEGORICAL_COLS:
+        cols = [f[col] for f in frames if col in f.columns]
+        if not any(isinstance(s.dtype, pd.CategoricalDtype) for s in cols):
+            continue
+        parts = [s.cat.categories if isinstance(s.dtype, pd.CategoricalDtype) else pd.Index(s.dropna().unique()) for s in cols]
+        categories = pd.Index(pd.concat([p.to_series() for p in parts]).unique()).astype("string").sort_values()
+        dtype = pd.CategoricalDtype(categories)
+        frames = [f.astype({col: dtype}) if col in f.columns and f[col].dtype != dtype else f for f in frames]
+    return frames
+
+def column_step(col: str, dtype) -> str:
+    """
+    How coerce_schema treats 'col' given only its dtype: "keep" (already exact), "check" (right dtype;
+    cast only if the data has missing values / unsorted categories) or "cast" (full cleanup).
+    """
+    if col in INT_COLS:
+        return "keep" if dtype == "int64" else "cast"
+    if col in FLOAT_COLS:
+        return "check" if dtype == "float64" else "cast"
+    if is_categorical_col(col):
+        ok = isinstance(dtype, pd.CategoricalDtype) and isinstance(dtype.categories.dtype, pd.StringDtype)
+    else:
+        ok = isinstance(dtype, pd.StringDtype) and dtype.na_value is pd.NA
+    return "check" if ok else "cast"
+
+@st.cache_resource
+def get_coercion_plans() -> dict:
+    return {}
+
+def coercion_plan(df: pd.DataFrame) -> Tuple[Tuple[str, str], ...]:
+    """(column, step) pairs for the schema columns, compiled once per column set + dtypes."""
+    # Categoricals by kind only: their category sets change with every new value
+    dtypes = tuple(("category", d.categories.dtype) if isinstance(d, pd.CategoricalDtype) else d for d in df.dtypes)
+    key = (tuple(df.columns), dtypes)
+    plans = get_coercion_plans()
+    plan = plans.get(key)
+    if plan is None:
+        plan = plans[key] = tuple((c, column_step(c, df[c].dtype)) for c in STRING_COLS + INT_COLS + FLOAT_COLS)
+    return plan
+
+def column_is_clean(s: pd.Series, col: str) -> bool:
+    """Data-dependent half of a "check" step (the dtype is already right)."""
+    if s.hasnans:
+        return False
+    return not isinstance(s.dtype, pd.CategoricalDtype) or s.cat.categories.is_monotonic_increasing
+
+def coerce_column(s: pd.Series, col: str) -> pd.Series:
+    if col in INT_COLS:
+        return pd.to_numeric(s, errors="coerce").fillna(0).astype("int64")
+    if col in FLOAT_COLS:
+        return pd.to_numeric(s, errors="coerce").fillna(0.0).astype("float64")
+    s = s.astype("string").fillna("").str.strip()
+    return as_categorical(s) if is_categorical_col(col) else s
 
-    # Hidden row id
-    if ROW_ID_COL not in df.columns:
-        df[ROW_ID_COL] = None
+def coerce_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Ensure required columns exist and dtypes are sane. Keep any extra columns present in file.
+    Columns that already have the target dtype and no missing values are left as they are, so
+    coercing an already-clean frame only costs a few missing-value checks.
+    """
+    # Shallow: only whole columns are replaced below, the caller's frame is never modified
+    df = df.copy(deep=False)
 
-    # Visible columns: create if missing
-    for c in USER_COLUMNS:
+    # Hidden row id + visible columns: create if missing
+    for c in [ROW_ID_COL] + USER_COLUMNS:
         if c not in df.columns:
             df[c] = None
 
-    # String cleanup
-    for c in STRING_COLS:
-        df[c] = df[c].astype("string").fillna("").str.strip()
-
-    # Numerics
-    for c in INT_COLS:
-        df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0).astype("int64")
-    for c in FLOAT_COLS:
-        df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0.0).astype("float64")
+    # Strings (stripped, categoricals for the low-cardinality ones) and numerics
+    for c, step in coercion_plan(df):
+        if step == "keep":
+            continue
+        if step == "check" and column_is_clean(df[c], c):
+            if isinstance(df[c].dtype, pd.CategoricalDtype) and df[c].cat.categories.dtype.na_value is not pd.NA:
+                df[c] = as_categorical(df[c])  # categories read back from a columnar file as 'str'
+            continue
+        df[c] = coerce_column(df[c], c)
 
     # Delete flag for editor convenience (not persisted)
     df[DELETE_COL] = False
 
     # Make sure row ids exist and are unique
-    mask_missing = df[ROW_ID_COL].isna() | (df[ROW_ID_COL].astype(str).str.len() == 0)
+    ids = df[ROW_ID_COL]
+    mask_missing = (ids.isna() | (ids == "")).to_numpy(dtype=bool)
     if mask_missing.any():
-        existing = set(df.loc[~mask_missing, ROW_ID_COL].astype(str))
-        for idx in df.index[mask_missing]:
-            rid = f"opw_{uuid.uuid4().hex}"
-            while rid in existing:
-                rid = f"opw_{uuid.uuid4().hex}"
-            df.at[idx, ROW_ID_COL] = rid
-            existing.add(rid)
+        df[ROW_ID_COL] = ids.astype(object)
+        df.loc[mask_missing, ROW_ID_COL] = new_row_ids(int(mask_missing.sum()), ids[~mask_missing])
 
     # Column order: keep extras but place our columns first in a consistent order
     leading = [ROW_ID_COL] + USER_COLUMNS + [DELETE_COL]
     extras = [c for c in df.columns if c not in leading]
-    df = df[leading + extras]
-
-    return df
+    return df[leading + extras]
 
 def init_empty_df() -> pd.DataFrame:
     df = pd.DataFrame(columns=[ROW_ID_COL] + USER_COLUMNS)
     return coerce_schema(df)
 
+def file_format(path: str) -> str:
+    ext = os.path.splitext(path.lower())[1]
+    if ext == ".xlsx":
+        return "xlsx"
+    if ext in PARQUET_EXTS:
+        return "parquet"
+    if ext in FEATHER_EXTS:
+        return "feather"
+    if ext in SQLITE_EXTS:
+        return "sqlite"
+    return "csv"
+
 def read_any(path: str) -> pd.DataFrame:
     if not os.path.exists(path):
         return init_empty_df()
-    if path.lower().endswith(".xlsx"):
+    return replay_journal(read_base(path), path)
+
+def read_base(path: str) -> pd.DataFrame:
+    fmt = file_format(path)
+    if fmt == "sqlite":
+        return read_sqlite(path)
+    if fmt == "xlsx":
         return pd.read_excel(path)
+    # Columnar files keep their dtypes and are memory-mapped instead of parsed
+    if fmt == "parquet":
+        return pd.read_parquet(path, memory_map=True)
+    if fmt == "feather":
+        import pyarrow.feather as feather
+        return feather.read_table(path, memory_map=True).to_pandas()
     return pd.read_csv(path)
 
-def write_any(df: pd.DataFrame, path: str):
-    # Don't persist UI-only columns
-    out = df.drop(columns=[DELETE_COL], errors="ignore").copy()
-    # Ensure schema before persist
-    out = coerce_schema(out)
-    # Update "Last Updated" only for rows that changed during this save cycle is complex;
-    # simple+reliable: set to now for all rows that are part of the edited set. Here we set for all.
-    out["Last Updated"] = ts_now()
+def serialize_any(out: pd.DataFrame, path: str) -> bytes:
+    """Encode a frame in the format implied by 'path' (same rules as read_any)."""
+    buf = io.BytesIO()
+    fmt = file_format(path)
+    if fmt == "xlsx":
+        with pd.ExcelWriter(buf, engine="xlsxwriter") as writer:
+            out.to_excel(writer, index=False, sheet_name="Inventory")
+    elif fmt == "parquet":
+        out.to_parquet(buf, index=False)
+    elif fmt == "feather":
+        out.reset_index(drop=True).to_feather(buf)
+    else:
+        out.to_csv(buf, index=False)
+    return buf.getvalue()
 
-    # Make a CSV backup of the current file (if exists), regardless of primary format
+def file_checksum(path: str) -> Optional[str]:
+    if not os.path.exists(path):
+        return None
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def clone_file(src: str, dst: str):
+    """Copy-on-write clone (reflink) where the filesystem supports it, else a plain byte copy."""
+    try:
+        import fcntl
+        FICLONE = 0x40049409  # linux/fs.h
+        with open(src, "rb") as fs, open(dst, "wb") as fd:
+            fcntl.ioctl(fd.fileno(), FICLONE, fs.fileno())
+        shutil.copystat(src, dst)
+        return
+    except (ImportError, OSError):
+        pass
+    shutil.copy2(src, dst)
+
+def gzip_in_background(path: str):
+    def work():
+        try:
+            with open(path, "rb") as fs, gzip.open(path + ".gz", "wb") as fd:
+                shutil.copyfileobj(fs, fd)
+            os.remove(path)
+        except OSError:
+            pass  # keep the uncompressed backup
+    threading.Thread(target=work, name="backup-gzip", daemon=True).start()
+
+def atomic_write_bytes(path: str, data: bytes):
+    """
+    Write to a temp file in the same directory, fsync, then os.replace() it over 'path', so readers
+    (other sessions doing Load / Reload) only ever see the old or the new file, never a partial one.
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.path.exists(path):
+            shutil.copymode(path, tmp)
+        else:
+            os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    # Make the rename itself durable (not supported on Windows)
+    try:
+        dir_fd = os.open(folder, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
+
+def backup_file(path: str) -> str:
+    stem, ext = os.path.splitext(os.path.basename(path))
+    bkp = os.path.join(BACKUP_DIR, f"{stem}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{ext}")
+    # Saves replace the live file with a new inode (atomic_write_bytes), so a hardlink
+    # keeps the previous version intact at zero copy cost; fall back to reflink/copy.
+    try:
+        os.link(path, bkp)
+    except OSError:
+        clone_file(path, bkp)
+    if BACKUP_GZIP:
+        gzip_in_background(bkp)
+    return bkp
+
+# Journal file layout (JSON lines next to the data file):
+#   {"journal": 1, "base": <base_signature>}            header: the base file the entries apply to
+#   {"ts": ..., "op": "upsert", "row": {<full row>}}     insert or update, keyed by row["_row_id"]
+#   {"ts": ..., "op": "delete", "id": <_row_id>}
+
+def journal_path(path: str) -> str:
+    return path + JOURNAL_SUFFIX
+
+def base_signature(path: str) -> dict:
+    # Every full write replaces the base with a new inode, which invalidates older journals
+    st_ = os.stat(path)
+    return {"ino": st_.st_ino, "size": st_.st_size, "mtime_ns": st_.st_mtime_ns}
+
+def journal_header(jpath: str) -> Optional[dict]:
+    with open(jpath, "rb") as f:
+        try:
+            return json.loads(f.readline())
+        except ValueError:
+            return None
+
+def json_default(value):
+    # numpy scalars / pandas NA from to_dict("records")
+    if pd.isna(value):
+        return None
+    return value.item() if hasattr(value, "item") else str(value)
+
+def replay_journal(base: pd.DataFrame, path: str) -> pd.DataFrame:
+    """Apply the journal's upserts/deletes (last entry per _row_id wins) on top of the base frame."""
+    jpath = journal_path(path)
+    if not os.path.exists(jpath) or ROW_ID_COL not in base.columns:
+        return base
+    ops = {}
+    with open(jpath, "rb") as f:
+        header = json.loads(f.readline() or "{}")
+        if header.get("base") != base_signature(path):
+            return base  # stale journal, already compacted into the base file
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # torn write from a crash mid-append
+            if entry.get("op") == "delete":
+                ops[entry["id"]] = None
+            else:
+                ops[entry["row"][ROW_ID_COL]] = entry["row"]
+    if not ops:
+        return base
+    kept = base[~base[ROW_ID_COL].astype(str).isin(list(ops.keys()))]
+    upserts = pd.DataFrame([row for row in ops.values() if row is not None])
+    if upserts.empty:
+        return kept.reset_index(drop=True)
+    # Keep the base dtypes so a typed (columnar) base stays on coerce_schema's fast path
+    for c in upserts.columns:
+        if c in base.columns and not isinstance(base[c].dtype, pd.CategoricalDtype):
+            try:
+                upserts[c] = upserts[c].astype(base[c].dtype)
+            except (TypeError, ValueError):
+                pass
+    return pd.concat(unify_categories(kept, upserts), ignore_index=True)
+
+def base_columns(path: str) -> List[str]:
+    fmt = file_format(path)
+    if fmt == "sqlite":
+        with closing(sqlite_connect(path)) as con:
+            return sqlite_columns(con)
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        return pq.read_schema(path).names
+    if fmt == "feather":
+        import pyarrow.feather as feather
+        return feather.read_table(path, memory_map=True).schema.names
+    if fmt == "xlsx":
+        return list(pd.read_excel(path, nrows=0).columns)
+    return list(pd.read_csv(path, nrows=0).columns)
+
+def journal_appendable(path: str) -> bool:
+    # Journal entries are keyed by _row_id, so the base file must already carry them
+    if not os.path.exists(path) or ROW_ID_COL not in base_columns(path):
+        return False
+    jpath = journal_path(path)
+    if not os.path.exists(jpath):
+        return True
+    return os.path.getsize(jpath) <= JOURNAL_COMPACT_RATIO * os.path.getsize(path)
+
+def append_journal(path: str, rows: pd.DataFrame, deleted: Iterable[str]) -> str:
+    """Append row upserts/deletes to the journal of 'path' (fsynced); returns the journal checksum."""
+    jpath = journal_path(path)
+    signature = base_signature(path)
+    if os.path.exists(jpath) and (journal_header(jpath) or {}).get("base") != signature:
+        retire_journal(path)
+    ts = ts_now()
+    lines = [] if os.path.exists(jpath) else [json.dumps({"journal": 1, "base": signature})]
+    lines += [json.dumps({"ts": ts, "op": "upsert", "row": row}, default=json_default) for row in rows.to_dict("records")]
+    lines += [json.dumps({"ts": ts, "op": "delete", "id": rid}) for rid in sorted(deleted)]
+    payload = ("\n".join(lines) + "\n").encode("utf-8")
+    with open(jpath, "ab") as f:
+        # Start on a fresh line if a previous append was torn by a crash
+        if f.tell() > 0:
+            with open(jpath, "rb") as tail:
+                tail.seek(-1, os.SEEK_END)
+                if tail.read(1) != b"\n":
+                    payload = b"\n" + payload
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    return file_checksum(jpath)
+
+def retire_journal(path: str):
+    """Move a compacted/stale journal into BACKUP_DIR, where it remains as the audit trail."""
+    jpath = journal_path(path)
+    if not os.path.exists(jpath):
+        return
+    stem = os.path.splitext(os.path.basename(path))[0]
+    try:
+        shutil.move(jpath, os.path.join(BACKUP_DIR, f"{stem}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{JOURNAL_SUFFIX}"))
+    except OSError:
+        pass  # replay ignores it anyway once the base file has been replaced
+
+def store_checksum(path: str) -> Optional[str]:
+    """Checksum of what write_any last wrote to 'path': its journal while one is active, else the file."""
+    if file_format(path) == "sqlite":
+        if not os.path.exists(path):
+            return None
+        # The header's file change counter moves on every committed write (rollback-journal mode)
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read(100)).hexdigest()
+    jpath = journal_path(path)
+    return file_checksum(jpath) if os.path.exists(jpath) else file_checksum(path)
+
+# SQLite backend: one table keyed on _row_id; saves with a known change set are row-level
+
+def sqlite_connect(path: str) -> sqlite3.Connection:
+    # Autocommit; write transactions are explicit (BEGIN IMMEDIATE ... COMMIT)
+    return sqlite3.connect(path, isolation_level=None, timeout=30)
+
+def sqlite_columns(con: sqlite3.Connection) -> List[str]:
+    return [row[1] for row in con.execute(f'PRAGMA table_info("{SQLITE_TABLE}")')]
+
+def sqlite_type(df: pd.DataFrame, col: str) -> str:
+    if col == ROW_ID_COL:
+        return "TEXT PRIMARY KEY"
+    dtype = df[col].dtype
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    return "TEXT"
+
+def sqlite_rows(df: pd.DataFrame):
+    # Plain Python values (NA -> NULL) that sqlite3 can bind
+    return df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+
+def read_sqlite(path: str) -> pd.DataFrame:
+    with closing(sqlite_connect(path)) as con:
+        cols = sqlite_columns(con)
+        if not cols:
+            return init_empty_df()
+        # Read text columns straight into the schema's string dtype
+        dtypes = {c: "string" for c in STRING_COLS if c in cols}
+        return pd.read_sql_query(f'SELECT * FROM "{SQLITE_TABLE}"', con, dtype=dtypes)
+
+def backup_sqlite(path: str, con: sqlite3.Connection) -> str:
+    stem, ext = os.path.splitext(os.path.basename(path))
+    bkp = os.path.join(BACKUP_DIR, f"{stem}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{ext}")
+    # Online backup API: a consistent copy even while other sessions write
+    with closing(sqlite3.connect(bkp)) as dst:
+        con.backup(dst)
+    if BACKUP_GZIP:
+        gzip_in_background(bkp)
+    return bkp
+
+def write_sqlite(out: pd.DataFrame, path: str, changes: Optional[dict]) -> bool:
+    """
+    Upsert the changed rows and delete the removed ones when the change set is known (i.e. relative
+    to this database) and the table has the same columns; otherwise (first save, other database,
+    schema change) back up and rebuild the table.
+    Returns whether the write was row-level.
+    """
+    cols = list(out.columns)
+    names = ", ".join(f'"{c}"' for c in cols)
+    insert = f'INSERT OR REPLACE INTO "{SQLITE_TABLE}" ({names}) VALUES ({", ".join("?" for _ in cols)})'
+    with closing(sqlite_connect(path)) as con:
+        existing = sqlite_columns(con)
+        row_level = changes is not None and existing == cols
+        if existing and not row_level:
+            try:
+                backup_sqlite(path, con)
+            except Exception:
+                pass  # continue save anyway
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            if row_level:
+                con.executemany(insert, sqlite_rows(out[out[ROW_ID_COL].isin(touched_ids(changes))]))
+                con.executemany(
+                    f'DELETE FROM "{SQLITE_TABLE}" WHERE "{ROW_ID_COL}" = ?', [(rid,) for rid in changes["deleted"]]
+                )
+            else:
+                con.execute(f'DROP TABLE IF EXISTS "{SQLITE_TABLE}"')
+                col_defs = ", ".join(f'"{c}" {sqlite_type(out, c)}' for c in cols)
+                con.execute(f'CREATE TABLE "{SQLITE_TABLE}" ({col_defs})')
+                con.executemany(insert, sqlite_rows(out))
+            for c in SQLITE_INDEXED:
+                index_name = f"idx_{SQLITE_TABLE}_" + c.lower().replace(" ", "_")
+                con.execute(f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{SQLITE_TABLE}" ("{c}")')
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+    return row_level
+
+def write_any(
+    df: pd.DataFrame, path: str, changes: Optional[dict] = None, journal: bool = False, same_store: bool = True
+) -> Tuple[Optional[pd.DataFrame], str]:
+    """
+    Persist 'df' to 'path'. 'changes' is the change set since the last save (see record_changes); only
+    its updated/inserted rows get a new "Last Updated" stamp (None = provenance unknown, stamp every row).
+    With 'journal', just those row changes are appended to the file's journal, until the journal
+    outgrows JOURNAL_COMPACT_RATIO of the base file; then the store (base + journal) with those row
+    changes applied is written in full (compaction).
+    'same_store' is False when 'path' is not the file 'changes' is relative to (loaded or last saved):
+    it holds none of this session's rows yet, so it is written in full (rows are still stamped by
+    'changes').
+    Returns the exact frame that was persisted (schema-coerced, with the UI-only delete flag) and the
+    checksum of what was written, so callers can adopt the frame instead of re-reading the file;
+    compare against store_checksum(path) to verify. After a row-level write (journal, SQLite upsert,
+    compaction) the frame is None: the store also keeps rows other sessions wrote, so it need not
+    equal 'df'.
+    """
+    # Ensure schema before persist
+    out = coerce_schema(df)
+    touched = None if changes is None else touched_ids(changes)
+    # .loc assignment is in place and keeps the string dtype
+    if touched is None:
+        out.loc[:, "Last Updated"] = ts_now()
+    elif touched:
+        out.loc[out[ROW_ID_COL].isin(touched), "Last Updated"] = ts_now()
+
+    # SQLite: row-level upserts/deletes inside a transaction (crash-safe on its own)
+    if file_format(path) == "sqlite":
+        row_level = write_sqlite(out.drop(columns=[DELETE_COL]), path, changes if same_store else None)
+        return (None if row_level else out), store_checksum(path)
+
+    # Journal mode: O(changed rows) append, the base file stays as it is
+    row_level = journal and same_store and changes is not None
+    if row_level and journal_appendable(path):
+        rows = out[out[ROW_ID_COL].isin(touched)].drop(columns=[DELETE_COL])
+        return None, append_journal(path, rows, changes["deleted"])
+    compacting = row_level and os.path.exists(journal_path(path))
+    if compacting:
+        # Fold this save into what the store holds, which includes other sessions' journaled
+        # saves, rather than writing this session's (possibly older) copy of their rows
+        store = coerce_schema(read_any(path))
+        kept = store[~store[ROW_ID_COL].isin(touched | changes["deleted"])]
+        out = pd.concat(unify_categories(kept, out[out[ROW_ID_COL].isin(touched)]), ignore_index=True)
+
+    # Back up the current file (if exists) as a byte-level copy in its own format
     if os.path.exists(path):
-        stem = os.path.splitext(os.path.basename(path))[0]
-        bkp = os.path.join(BACKUP_DIR, f"{stem}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
         try:
-            prev = read_any(path)
-            prev.to_csv(bkp, index=False)
+            backup_file(path)
         except Exception:
             pass  # continue save anyway
 
-    # Persist
-    if path.lower().endswith(".xlsx"):
-        with pd.ExcelWriter(path, engine="xlsxwriter") as writer:
-            out.to_excel(writer, index=False, sheet_name="Inventory")
-    else:
-        out.to_csv(path, index=False)
+    # Persist (don't persist UI-only columns)
+    data = serialize_any(out.drop(columns=[DELETE_COL]), path)
+    atomic_write_bytes(path, data)
+    # The full frame now includes everything the journal held
+    retire_journal(path)
+    return (None if compacting else out), hashlib.sha256(data).hexdigest()
 
-def apply_sort(df: pd.DataFrame, sort_cols: List[str], ascending: bool = True) -> pd.DataFrame:
+def sort_order(df: pd.DataFrame, sort_cols: List[str], ascending: bool = True) -> np.ndarray:
+    """Positions of 'df' in sorted order (stable: ties keep their current order)."""
     keep_cols = [c for c in sort_cols if c in df.columns]
-    if keep_cols:
-        return df.sort_values(keep_cols, ascending=ascending, kind="mergesort").reset_index(drop=True)
-    return df.reset_index(drop=True)
+    if not keep_cols:
+        return np.arange(len(df.index))
+    keys = df[keep_cols].reset_index(drop=True)
+    return keys.sort_values(keep_cols, ascending=ascending, kind="mergesort").index.to_numpy()
+
+def excel_values(s: pd.Series) -> list:
+    """Column values as Python scalars for xlsxwriter's write(); None (skipped) where missing."""
+    return s.astype(object).where(s.notna(), None).tolist()
 
 def export_excel_bytes(df: pd.DataFrame) -> bytes:
-    out = io.BytesIO()
-    with pd.ExcelWriter(out, engine="xlsxwriter") as writer:
-        df_out = df.drop(columns=[DELETE_COL], errors="ignore").copy()
-        df_out.to_excel(writer, index=False, sheet_name="Inventory")
-        wb = writer.book
+    """
+    df as an .xlsx workbook, written to a temp file with xlsxwriter's constant_memory mode: each row
+    is flushed to disk once the next starts, and rows are converted from df EXPORT_CHUNK_ROWS at a
+    time, so memory stays flat however large the inventory. Cells and column formats match a pandas
+    to_excel export. Only the finished (compressed) file is read back.
+    """
+    import xlsxwriter
+
+    df_out = df.drop(columns=[DELETE_COL], errors="ignore")
+    fd, tmp = tempfile.mkstemp(prefix="inventory_export.", suffix=".xlsx")
+    os.close(fd)
+    try:
+        wb = xlsxwriter.Workbook(tmp, {"constant_memory": True})
+        ws = wb.add_worksheet("Inventory")
         money_fmt = wb.add_format({"num_format": "#,##0.00"})
         qty_fmt = wb.add_format({"num_format": "0"})
-        ws = writer.sheets["Inventory"]
         cols = {c: i for i, c in enumerate(df_out.columns)}
         if "Unit Cost (ZAR)" in cols:
             ws.set_column(cols["Unit Cost (ZAR)"], cols["Unit Cost (ZAR)"], 14, money_fmt)
         for c in INT_COLS:
             if c in cols:
                 ws.set_column(cols[c], cols[c], 10, qty_fmt)
-    out.seek(0)
-    return out.read()
+        # constant_memory: rows must be written strictly top to bottom
+        ws.write_row(0, 0, [str(c) for c in df_out.columns])
+        for start in range(0, len(df_out.index), EXPORT_CHUNK_ROWS):
+            chunk = df_out.iloc[start : start + EXPORT_CHUNK_ROWS]
+            values = [excel_values(chunk[c]) for c in chunk.columns]
+            for row, cells in enumerate(zip(*values), start=start + 1):
+                ws.write_row(row, 0, cells)
+        wb.close()
+        with open(tmp, "rb") as f:
+            return f.read()
+    finally:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+# --------------------- CHANGE TRACKING ------------------------
+
+def new_change_set() -> dict:
+    """Row ids changed since the last load/save, split by kind."""
+    return {"updated": set(), "inserted": set(), "deleted": set()}
+
+def record_changes(changes: dict, updated: Iterable[str] = (), inserted: Iterable[str] = (), deleted: Iterable[str] = ()):
+    """Fold row-level changes into 'changes', keeping only the net effect since the last save."""
+    changes["inserted"].update(inserted)
+    changes["updated"].update(rid for rid in updated if rid not in changes["inserted"])
+    for rid in deleted:
+        if rid in changes["inserted"]:
+            changes["inserted"].discard(rid)  # never persisted: nothing to delete
+        else:
+            changes["updated"].discard(rid)
+            changes["deleted"].add(rid)
+
+def combine_changes(earlier: dict, later: dict) -> dict:
+    """Net change set of two consecutive change sets."""
+    combined = {kind: set(ids) for kind, ids in earlier.items()}
+    record_changes(combined, later["updated"], later["inserted"], later["deleted"])
+    return combined
+
+def has_changes(changes: dict) -> bool:
+    return bool(changes["updated"] or changes["inserted"] or changes["deleted"])
+
+def touched_ids(changes: dict) -> Set[str]:
+    return changes["updated"] | changes["inserted"]
+
+# ------------------------ AUTOSAVE ----------------------------
+
+class AutosaveWorker:
+    """
+    Background writer shared by all sessions. Submissions are coalesced per (session, path) (only
+    the session's latest frame is kept) and written once no newer one has arrived for 'delay'
+    seconds. Another session's frame never carries this session's change set: it holds a stale
+    copy of those rows.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = {}  # (session, path) -> (due, df, changes, journal, same_store)
+        self.last_saved = {}  # path -> timestamp of last successful write
+        self.last_error = {}  # path -> message of last failed write
+        self._failed = {}  # (session, path) -> (changes, same_store) of writes that failed, still unsaved
+        threading.Thread(target=self._run, name="autosave", daemon=True).start()
+
+    def submit(
+        self, session: str, df: pd.DataFrame, path: str, delay: float, changes: dict, journal: bool, same_store: bool
+    ):
+        """Queue 'df' (already in the order it should be written) for 'path' on behalf of 'session'."""
+        with self._lock:
+            # A superseded submission was never written, so its changes (and a pending full
+            # write to a new store) still need persisting
+            prev = self._pending.get((session, path))
+            if prev is not None:
+                changes = combine_changes(prev[2], changes)
+                journal, same_store = journal and prev[3], same_store and prev[4]
+            # So do those of a failed write; 'df' has the current values of its rows
+            failed = self._failed.pop((session, path), None)
+            if failed is not None:
+                changes = combine_changes(failed[0], changes)
+                same_store = same_store and failed[1]
+            self._pending[(session, path)] = (time.monotonic() + delay, df, changes, journal, same_store)
+        self._wake.set()
+
+    def discard(self, session: str, path: str) -> Optional[Tuple[dict, bool]]:
+        """
+        Drop the session's pending write for 'path'; returns the (change set, same_store) it and any
+        failed writes of the session to 'path' still owe, or None if there are none.
+        """
+        with self._lock:
+            job = self._pending.pop((session, path), None)
+            failed = self._failed.pop((session, path), None)
+        if job is not None:
+            job = (job[2], job[4])
+        if failed is None:
+            return job
+        if job is None:
+            return failed
+        return combine_changes(failed[0], job[0]), failed[1] and job[1]
+
+    def _run(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                jobs = [(k, self._pending.pop(k)) for k, job in list(self._pending.items()) if job[0] <= now]
+                next_due = min((job[0] for job in self._pending.values()), default=None)
+            for (session, path), (_, df, changes, journal, same_store) in jobs:
+                try:
+                    write_any(df, path, changes, journal, same_store)
+                    self.last_saved[path] = ts_now()
+                    self.last_error.pop(path, None)
+                except Exception as e:
+                    self.last_error[path] = str(e)
+                    # Keep what the write owed: the next submission or a manual Save picks it up
+                    with self._lock:
+                        failed = self._failed.get((session, path))
+                        if failed is not None:
+                            changes = combine_changes(failed[0], changes)
+                            same_store = same_store and failed[1]
+                        self._failed[(session, path)] = (changes, same_store)
+            self._wake.wait(None if next_due is None else max(next_due - time.monotonic(), 0.0))
+            self._wake.clear()
+
+@st.cache_resource
+def get_autosave_worker() -> AutosaveWorker:
+    return AutosaveWorker()
+
+# ---------------------- SHARED CACHE --------------------------
+
+class LRUCache:
+    """
+    Thread-safe LRU bounded by entry count and approximate memory. Values are shared by every
+    session and must be treated as read-only.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, nbytes)
+        self._nbytes = 0
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+    def get(self, key: tuple, default=None):
+        with self._lock:
+            hit = self._entries.get(key)
+            if hit is None:
+                return default
+            self._entries.move_to_end(key)
+            return hit[0]
+
+    def put(self, key: tuple, value, nbytes: int):
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (value, nbytes)
+            self._nbytes += nbytes
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._nbytes > self.max_bytes):
+                self._pop(next(iter(self._entries)))
+
+    def evict(self, predicate):
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                self._pop(key)
+
+    def _pop(self, key: tuple):
+        hit = self._entries.pop(key, None)
+        if hit is not None:
+            self._nbytes -= hit[1]
+
+def approx_nbytes(value) -> int:
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        # deep: the _row_id strings and other object/text columns are most of a frame's footprint
+        return int(value.memory_usage(index=False, deep=True).sum())
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sum(approx_nbytes(v) for v in value)
+    return int(getattr(value, "nbytes", 1024))
+
+def storage_key(path: str) -> tuple:
+    """(schema version, path, file versions): changes whenever the file or its journal does."""
+    sigs = []
+    for p in (path, journal_path(path)):
+        try:
+            st_ = os.stat(p)
+            sigs.append((st_.st_mtime_ns, st_.st_size))
+        except OSError:
+            sigs.append(None)
+    return (SCHEMA_VERSION, os.path.abspath(path), tuple(sigs))
+
+@st.cache_resource
+def get_frame_cache() -> LRUCache:
+    return LRUCache(CACHE_MAX_ENTRIES, CACHE_MAX_BYTES)
+
+@st.cache_resource
+def get_memo_cache() -> LRUCache:
+    return LRUCache(MEMO_MAX_ENTRIES, MEMO_MAX_BYTES)
+
+@st.cache_resource
+def get_version_counter():
+    return itertools.count(1)
+
+def next_data_version() -> int:
+    """Process-wide, monotonically increasing: every distinct inventory state gets its own number."""
+    return next(get_version_counter())
+
+def cache_inventory(key: tuple, df: pd.DataFrame) -> Tuple[pd.DataFrame, int]:
+    """Publish 'df' as the shared frame for file version 'key'; returns (frame, data version)."""
+    cache = get_frame_cache()
+    # Older versions of the same file are dead weight
+    cache.evict(lambda k: k[:2] == key[:2] and k != key)
+    entry = (df, next_data_version())
+    cache.put(key, entry, int(df.memory_usage(deep=True).sum()))
+    return entry
+
+def load_inventory(path: str) -> Tuple[pd.DataFrame, int]:
+    """
+    coerce_schema(read_any(path)), parsed once per file version and shared (read-only) by all
+    sessions, with the data version that keys everything derived from it (see memo).
+    """
+    key = storage_key(path)
+    entry = get_frame_cache().get(key)
+    if entry is None:
+        entry = cache_inventory(key, coerce_schema(read_any(path)))
+    return entry
+
+_MISSING = object()
+
+def memo(version: int, name: str, params: tuple, compute):
+    """
+    compute() once per (data version, name, params). Sessions on the same version (e.g. the same
+    unedited file) share the result, and an idle rerun only does dictionary lookups.
+    """
+    cache = get_memo_cache()
+    key = (version, name, params)
+    value = cache.get(key, _MISSING)
+    if value is _MISSING:
+        value = compute()
+        cache.put(key, value, approx_nbytes(value))
+    return value
+
+# ------------------------- OVERLAY ----------------------------
+# Each session keeps the shared (cached, read-only) base frame plus a small overlay of its own
+# edits: full copies of edited/inserted rows indexed by _row_id, and the ids it deleted.
+
+def by_row_id(df: pd.DataFrame) -> pd.DataFrame:
+    return df.set_axis(pd.Index(df[ROW_ID_COL].astype(object), name=None), axis=0)
+
+def new_overlay(base: pd.DataFrame) -> dict:
+    return {"rows": by_row_id(base.iloc[:0]), "deleted": set()}
+
+def overlay_upsert(overlay: dict, rows: pd.DataFrame) -> dict:
+    """New overlay where 'rows' (base columns) replace any overlay rows with the same ids."""
+    rows = by_row_id(rows)
+    kept = overlay["rows"][~overlay["rows"].index.isin(rows.index)]
+    if len(kept):
+        rows = pd.concat(unify_categories(kept, rows))
+    return {"rows": rows, "deleted": overlay["deleted"]}
+
+def materialize(base: pd.DataFrame, overlay: dict) -> pd.DataFrame:
+    """
+    The session's inventory: 'base' with the overlay applied, in base order (inserted rows last).
+    Returns 'base' itself while the overlay is empty; otherwise a transient frame for this rerun only.
+    """
+    rows, deleted = overlay["rows"], overlay["deleted"]
+    if rows.empty and not deleted:
+        return base
+    df = base[~base[ROW_ID_COL].isin(deleted)] if deleted else base
+    # Edited/inserted values may be new categories
+    df, rows = unify_categories(df, rows)
+    pos = pd.Index(df[ROW_ID_COL]).get_indexer(rows.index)
+    found = pos >= 0
+    if found.any():
+        patch = rows[found]
+        columns = {}
+        for col in df.columns:
+            column = df[col].copy()
+            column.iloc[pos[found]] = patch[col].to_numpy()
+            columns[col] = column
+        df = pd.DataFrame(columns, index=df.index)
+    inserted = rows[~found]
+    if len(inserted):
+        df = pd.concat([df, inserted.reindex(columns=df.columns)], ignore_index=True)
+    return df.reset_index(drop=True)
+
+def sort_key_arrays(df: pd.DataFrame, sort_cols: List[str]) -> List[Tuple[np.ndarray, Optional[pd.Index]]]:
+    """Per sort column: comparable values per row and, for categoricals, the (sorted) categories."""
+    out = []
+    for col in sort_cols:
+        if col not in df.columns:
+            continue
+        s = df[col]
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            # Doubled codes leave room for values between two categories (see row_sort_key)
+            out.append((s.cat.codes.to_numpy().astype(np.int64) * 2, s.cat.categories))
+        else:
+            out.append((s.to_numpy(), None))
+    return out
+
+def row_sort_key(value, categories: Optional[pd.Index]):
+    """'value' on the scale of sort_key_arrays() (it may be a category the base doesn't have)."""
+    if categories is None:
+        return value
+    i = int(categories.searchsorted(value))
+    return 2 * i if i < len(categories) and categories[i] == value else 2 * i - 1
+
+def overlay_sort_order(
+    ids: pd.Index, base_keys: list, base_order: np.ndarray, overlay: dict, sort_cols: List[str], ascending: bool = True
+) -> np.ndarray:
+    """
+    sort_order() of materialize(base, overlay), derived from the base's: 'ids' are the base row ids,
+    'base_keys' = sort_key_arrays(base), 'base_order' = sort_order(base). Base rows the overlay deleted
+    or replaced are dropped from the base order (vectorized) and the overlay's own rows are merged back
+    in by binary search, so k edited rows cost O(n + k log n) instead of a full sort.
+    """
+    rows, deleted = overlay["rows"], overlay["deleted"]
+    deleted_pos = np.sort(ids.get_indexer(list(deleted)))
+    deleted_pos = deleted_pos[deleted_pos >= 0]
+    row_pos = ids.get_indexer(rows.index)
+    inserted = row_pos < 0
+    kept = base_order[~np.isin(base_order, np.concatenate([deleted_pos, row_pos[~inserted]]))]
+
+    # Overlay rows compare on their own values; replaced rows keep their base position for ties,
+    # inserted rows come after every base row (like materialize appends them)
+    tie_pos = np.where(inserted, len(ids) + np.cumsum(inserted) - 1, row_pos)
+    cols = [c for c in sort_cols if c in rows.columns]
+    row_values = list(zip(*(rows[c].tolist() for c in cols))) if cols else [()] * len(rows.index)
+    row_keys = [tuple(row_sort_key(v, categories) for v, (_, categories) in zip(values, base_keys)) for values in row_values]
+
+    def compare(a: tuple, b: tuple) -> int:
+        # (keys, tie position); only the keys follow the sort direction
+        if a[0] != b[0]:
+            return -1 if (a[0] < b[0]) == ascending else 1
+        return -1 if a[1] < b[1] else (1 if a[1] > b[1] else 0)
+
+    def base_item(pos: int) -> tuple:
+        return tuple(values[pos] for values, _ in base_keys), pos
+
+    # Among themselves by value: two new categories can share a key (both between the same two base ones)
+    moved = sorted(range(len(row_keys)), key=cmp_to_key(lambda i, j: compare((row_values[i], tie_pos[i]), (row_values[j], tie_pos[j]))))
+    slots = []
+    for i in moved:
+        item = (row_keys[i], tie_pos[i])
+        lo, hi = 0, len(kept)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if compare(base_item(kept[mid]), item) < 0:
+                lo = mid + 1
+            else:
+                hi = mid
+        slots.append(lo)
+
+    # Base positions -> positions in the materialized frame (deleted rows shift the rest up)
+    kept = kept - np.searchsorted(deleted_pos, kept)
+    moved = np.asarray(moved, dtype=np.int64)
+    moved_pos = np.where(
+        inserted[moved], len(ids) - len(deleted_pos) + (tie_pos[moved] - len(ids)), row_pos[moved] - np.searchsorted(deleted_pos, row_pos[moved])
+    )
+    return np.insert(kept, slots, moved_pos)
+
+# ------------------------- SEARCH -----------------------------
+# Indexes over the lowercased "Item Code \n Description" text of the shared base frame, built once per
+# base version; the session's overlay rows (few) are scanned/indexed separately.
+
+def search_text(df: pd.DataFrame) -> pd.Series:
+    # "\n" never occurs in a query, so a match always lies within one of the two fields
+    return df["Item Code"].astype("string").str.lower() + "\n" + df["Description"].astype("string").str.lower()
+
+def trigram_codes(cp: np.ndarray) -> np.ndarray:
+    """int64 code of every trigram in an array of code points (21 bits per character)."""
+    return (cp[:-2] << 42) | (cp[1:-1] << 21) | cp[2:]
+
+def code_points(text: str) -> np.ndarray:
+    return np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.int64)
+
+def text_trigrams(texts: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """(trigram code, position) for every trigram of every text; none spans a "\n"."""
+    lens = texts.str.len().to_numpy(dtype=np.int64)
+    # All texts in one code point array, "\0"-separated; windows spanning a separator are dropped
+    cp = code_points("\0".join(texts.tolist()) + "\0")
+    row_of = np.repeat(np.arange(len(lens), dtype=np.int32), lens + 1)
+    sep = (cp == 0) | (cp == 10)
+    ok = ~(sep[:-2] | sep[1:-1] | sep[2:])
+    return trigram_codes(cp)[ok], row_of[:-2][ok]
+
+def build_postings(keys: np.ndarray, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    CSR inverted index from (key, row) pairs given in ascending row order: sorted unique keys, and
+    per key i the distinct rows rows[bounds[i]:bounds[i + 1]] (ascending).
+    """
+    # Stable: rows stay ascending within each key; then drop repeats of a key in one row
+    order = np.argsort(keys, kind="stable")
+    keys, rows = keys[order], rows[order]
+    keep = np.ones(len(rows), dtype=bool)
+    keep[1:] = (keys[1:] != keys[:-1]) | (rows[1:] != rows[:-1])
+    keys, rows = keys[keep], rows[keep]
+    uniq, starts = np.unique(keys, return_index=True)
+    return uniq, np.append(starts, len(rows)), rows
+
+class SearchIndex:
+    """
+    Inverted trigram index: 'grams' (sorted unique trigram codes) and 'rows', the positions holding
+    each gram (grams[i] -> rows[bounds[i]:bounds[i + 1]], ascending). Queries intersect the posting
+    lists of their trigrams and verify the few candidates with a plain substring test.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.text = search_text(df).fillna("")
+        self.grams, self.bounds, self.rows = build_postings(*text_trigrams(self.text))
+        self.nbytes = int(self.grams.nbytes + self.bounds.nbytes + self.rows.nbytes + self.text.memory_usage(deep=True))
+
+    def query(self, q: str) -> np.ndarray:
+        """Ascending positions whose text contains 'q' (already lowercased)."""
+        if len(q) < 3:
+            return np.flatnonzero(self.text.str.contains(q, regex=False).to_numpy(dtype=bool))
+        wanted = np.unique(trigram_codes(code_points(q)))
+        idx = np.searchsorted(self.grams, wanted)
+        if (idx >= len(self.grams)).any() or (self.grams[idx] != wanted).any():
+            return np.array([], dtype=np.int32)
+        postings = sorted((self.rows[self.bounds[i]:self.bounds[i + 1]] for i in idx), key=len)
+        candidates = postings[0]
+        for rows in postings[1:]:
+            candidates = np.intersect1d(candidates, rows, assume_unique=True)
+            if not len(candidates):
+                return candidates
+        if len(q) == 3:
+            return candidates
+        return candidates[self.text.iloc[candidates].str.contains(q, regex=False).to_numpy(dtype=bool)]
+
+def search_matches(df: pd.DataFrame, base: pd.DataFrame, overlay: dict, base_version: int, q: str) -> np.ndarray:
+    """Boolean mask over 'df' (= materialize(base, overlay)) of rows whose Item Code or Description contains 'q'."""
+    index = memo(base_version, "search_index", (), lambda: SearchIndex(base))
+    hits = index.query(q)
+    rows = overlay["rows"]
+    if rows.empty and not overlay["deleted"]:
+        mask = np.zeros(len(df.index), dtype=bool)
+        mask[hits] = True
+        return mask
+    # Base hits, except rows the overlay replaced (their text may have changed), plus overlay hits
+    ids = base[ROW_ID_COL].iloc[hits]
+    ids = ids[~ids.isin(rows.index)]
+    overlay_hits = rows.index[search_text(rows).str.contains(q, regex=False, na=False).to_numpy(dtype=bool)]
+    return df[ROW_ID_COL].isin(np.concatenate([ids.to_numpy(dtype=object), overlay_hits.to_numpy(dtype=object)])).to_numpy(dtype=bool)
+
+class TokenIndex:
+    """
+    Fuzzy search over the alphanumeric tokens of Item Code / Description: the token vocabulary, the
+    rows of each token, and a trigram index over the vocabulary itself. A query token is compared with
+    the vocabulary (trigram overlap, so typos and abbreviations like "galv" still match), never with
+    the rows, so a query costs about the vocabulary size rather than the inventory size.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        tokens = search_text(df).fillna("").reset_index(drop=True).str.findall(r"[a-z0-9]+").explode().dropna()
+        codes, vocab = pd.factorize(tokens.to_numpy(dtype=object))
+        self.n = len(df.index)
+        self.vocab = vocab
+        _, self.bounds, self.rows = build_postings(codes.astype(np.int64), tokens.index.to_numpy(dtype=np.int32))
+        # Front-padded, so a shared prefix contributes extra trigrams
+        grams, token_ids = text_trigrams(pd.Series(["  " + t for t in vocab], dtype=object))
+        self.grams, self.gram_bounds, self.gram_tokens = build_postings(grams, token_ids)
+        self.token_grams = np.bincount(self.gram_tokens, minlength=len(vocab))
+        self.nbytes = int(
+            sum(a.nbytes for a in (self.bounds, self.rows, self.grams, self.gram_bounds, self.gram_tokens)) + 64 * len(vocab)
+        )
+
+    def similar(self, token: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Vocabulary ids similar to 'token' and their similarity in (0, 1]."""
+        wanted = np.unique(trigram_codes(code_points("  " + token)))
+        idx = np.searchsorted(self.grams, wanted)
+        found = idx < len(self.grams)
+        found[found] = self.grams[idx[found]] == wanted[found]
+        idx = idx[found]
+        if not len(idx):
+            return np.array([], dtype=np.int64), np.array([])
+        shared = np.bincount(
+            np.concatenate([self.gram_tokens[self.gram_bounds[i]:self.gram_bounds[i + 1]] for i in idx]), minlength=len(self.vocab)
+        )
+        ids = np.flatnonzero(shared)
+        # Dice-like, but the query's own trigrams weigh fully: "galv" ~ "galvanised" scores 0.57
+        similarity = shared[ids] / (len(wanted) + 0.5 * (self.token_grams[ids] - shared[ids]))
+        keep = similarity >= FUZZY_MIN_SIMILARITY
+        return ids[keep], similarity[keep]
+
+    def query(self, q: str) -> np.ndarray:
+        """Score per row: the mean over the query's tokens of the best similarity among the row's tokens."""
+        total = np.zeros(self.n)
+        tokens = sorted(set(re.findall(r"[a-z0-9]+", q)))
+        for token in tokens:
+            ids, similarity = self.similar(token)
+            if not len(ids):
+                continue
+            counts = self.bounds[ids + 1] - self.bounds[ids]
+            rows = np.concatenate([self.rows[self.bounds[i]:self.bounds[i + 1]] for i in ids])
+            sims = np.repeat(similarity, counts)
+            # Each row keeps its best similarity (unbuffered, so repeated rows are all compared)
+            best = np.zeros(self.n)
+            np.maximum.at(best, rows, sims)
+            total += best
+        return total / max(len(tokens), 1)
+
+def fuzzy_scores(df: pd.DataFrame, base: pd.DataFrame, overlay: dict, base_version: int, q: str) -> np.ndarray:
+    """TokenIndex.query() scores over 'df' (= materialize(base, overlay))."""
+    scores = memo(base_version, "token_index", (), lambda: TokenIndex(base)).query(q)
+    rows = overlay["rows"]
+    if rows.empty and not overlay["deleted"]:
+        return scores
+    # Scores by row id: base rows the overlay did not replace, then the overlay's own rows
+    by_id = pd.Series(scores, index=base[ROW_ID_COL].to_numpy(dtype=object))
+    by_id = by_id[(by_id > 0) & ~by_id.index.isin(rows.index)]
+    if len(rows):
+        by_id = pd.concat([by_id, pd.Series(TokenIndex(rows).query(q), index=rows.index)])
+    return df[ROW_ID_COL].map(by_id).fillna(0.0).to_numpy(dtype=float)
+
+# -------------------------- VIEWS -----------------------------
+# Everything derived from the inventory goes through memo() keyed by the session's data version.
+
+def current_inventory(base: pd.DataFrame, overlay: dict, version: int) -> pd.DataFrame:
+    if overlay["rows"].empty and not overlay["deleted"]:
+        return base
+    return memo(version, "materialize", (), lambda: materialize(base, overlay))
+
+def inventory_order(
+    df: pd.DataFrame, base: pd.DataFrame, overlay: dict, base_version: int, version: int, sort_cols: List[str], ascending: bool
+) -> np.ndarray:
+    """
+    Sort permutation of df = materialize(base, overlay), one per (data version, sort), shared by the
+    editor view, autosave, save and export. After edits it is derived from the base's permutation.
+    """
+    sort_key = (tuple(sort_cols), ascending)
+    base_order = memo(base_version, "sort_order", sort_key, lambda: sort_order(base, sort_cols, ascending))
+    if overlay["rows"].empty and not overlay["deleted"]:
+        return base_order
+    if not any(c in df.columns for c in sort_cols):
+        return np.arange(len(df.index))
+
+    def derive():
+        ids = base_row_ids(base, base_version)
+        base_keys = memo(base_version, "sort_keys", tuple(sort_cols), lambda: sort_key_arrays(base, sort_cols))
+        return overlay_sort_order(ids, base_keys, base_order, overlay, sort_cols, ascending)
+
+    return memo(version, "sort_order", sort_key, derive)
+
+def inventory_aggregates(df: pd.DataFrame) -> dict:
+    """
+    Header metrics: {"total": Series(Items, Total Qty, Stock Value)} plus, per METRIC_GROUPS column,
+    a frame of the same three per value (group codes + np.bincount, no groupby).
+    """
+    qty = df["Qty On Hand"].to_numpy(dtype=np.int64)
+    value = qty * df["Unit Cost (ZAR)"].to_numpy(dtype=float)
+    out = {"total": pd.Series({"Items": len(qty), "Total Qty": int(qty.sum()), "Stock Value": float(value.sum())})}
+    for col in METRIC_GROUPS:
+        s = df[col]
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            codes, labels = s.cat.codes.to_numpy(), s.cat.categories
+        else:
+            codes, labels = pd.factorize(s, sort=True)
+        groups = pd.DataFrame(
+            {
+                "Items": np.bincount(codes, minlength=len(labels)),
+                "Total Qty": np.bincount(codes, weights=qty, minlength=len(labels)).astype(np.int64),
+                "Stock Value": np.bincount(codes, weights=value, minlength=len(labels)),
+            },
+            index=pd.Index(labels, dtype="string", name=col),
+        )
+        out[col] = groups[groups["Items"] > 0]
+    return out
+
+def adjust_aggregates(agg: dict, removed: dict, added: dict) -> dict:
+    """'agg' minus the contributions of 'removed' rows plus those of 'added' rows."""
+    out = {"total": agg["total"] - removed["total"] + added["total"]}
+    for col in METRIC_GROUPS:
+        groups = agg[col].sub(removed[col], fill_value=0).add(added[col], fill_value=0)
+        groups = groups.astype({"Items": "int64", "Total Qty": "int64"})
+        out[col] = groups[groups["Items"] > 0].sort_index()
+    return out
+
+def base_row_ids(base: pd.DataFrame, base_version: int) -> pd.Index:
+    # Its hash table is built on first lookup and then reused for the whole base version
+    return memo(base_version, "row_ids", (), lambda: pd.Index(base[ROW_ID_COL]))
+
+def current_aggregates(base: pd.DataFrame, overlay: dict, base_version: int, version: int) -> dict:
+    """
+    inventory_aggregates() of materialize(base, overlay): computed in full once per base version, then
+    adjusted by the overlay only (base rows it deleted or replaced out, its own rows in). Each version
+    starts again from the base's exact sums, so float error can't build up across edits.
+    """
+    base_agg = memo(base_version, "aggregates", (), lambda: inventory_aggregates(base))
+    rows, deleted = overlay["rows"], overlay["deleted"]
+    if rows.empty and not deleted:
+        return base_agg
+
+    def derive():
+        pos = base_row_ids(base, base_version).get_indexer(list(deleted) + list(rows.index))
+        cols = ["Qty On Hand", "Unit Cost (ZAR)"] + METRIC_GROUPS
+        return adjust_aggregates(base_agg, inventory_aggregates(base[cols].iloc[pos[pos >= 0]]), inventory_aggregates(rows[cols]))
+
+    return memo(version, "aggregates", (), derive)
+
+class FacetIndex:
+    """
+    Group codes of the FACET_COLS over one inventory version: per column the sorted distinct values and
+    each row's code into them (the categorical codes where available), so counts under any selection
+    are a boolean mask plus np.bincount instead of unique()/groupby over the strings.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.values, self.codes, self.options = {}, {}, {}
+        for col in FACET_COLS:
+            s = df[col]
+            if isinstance(s.dtype, pd.CategoricalDtype):
+                codes, values = s.cat.codes.to_numpy(), s.cat.categories
+            else:
+                codes, values = pd.factorize(s, sort=True)
+            self.values[col], self.codes[col] = pd.Index(values), codes
+            # Values in use, without the blank one
+            used = np.bincount(codes[codes >= 0], minlength=len(values)) > 0
+            self.options[col] = [v for v, u in zip(values, used) if u and v]
+        self.nbytes = int(sum(c.nbytes for c in self.codes.values()))
+
+    def mask(self, col: str, selected: Iterable[str]) -> np.ndarray:
+        idx = self.values[col].get_indexer(list(selected))
+        # One extra (False) slot for code -1 (missing)
+        wanted = np.zeros(len(self.values[col]) + 1, dtype=bool)
+        wanted[idx[idx >= 0]] = True
+        return wanted[self.codes[col]]
+
+    def counts(self, selections: dict) -> dict:
+        """{col: {value: rows}}, each column counted under the *other* columns' selections."""
+        masks = {col: self.mask(col, values) for col, values in selections.items() if values}
+        out = {}
+        for col in FACET_COLS:
+            codes = self.codes[col]
+            others = [m for c, m in masks.items() if c != col]
+            if others:
+                codes = codes[np.logical_and.reduce(others)]
+            counts = np.bincount(codes[codes >= 0], minlength=len(self.values[col]))
+            out[col] = dict(zip(self.values[col], counts.tolist()))
+        return out
+
+# Filter predicates are hashable tuples, so their masks can be memoized per data version:
+#   ("in", col, values)        value of 'col' is one of 'values'
+#   ("range", col, lo, hi)     lo <= 'col' <= hi (either bound may be None)
+#   ("below_min",)             Qty On Hand < Min Level
+#   ("above_max",)             Qty On Hand > Max Level (rows with a Max Level set)
+#   ("updated_before", ts)     Last Updated earlier than 'ts' (never-stamped rows included)
+
+def predicate_mask(df: pd.DataFrame, predicate: tuple) -> np.ndarray:
+    kind, *args = predicate
+    if kind == "in":
+        col, values = args
+        return df[col].isin(values).to_numpy(dtype=bool)
+    if kind == "range":
+        col, lo, hi = args
+        values = df[col].to_numpy()
+        mask = np.ones(len(values), dtype=bool)
+        if lo is not None:
+            mask &= values >= lo
+        if hi is not None:
+            mask &= values <= hi
+        return mask
+    if kind == "below_min":
+        return (df["Qty On Hand"] < df["Min Level"]).to_numpy(dtype=bool)
+    if kind == "above_max":
+        return ((df["Max Level"] > 0) & (df["Qty On Hand"] > df["Max Level"])).to_numpy(dtype=bool)
+    if kind == "updated_before":
+        (ts,) = args
+        # ts_now() stamps order as text; "" (never stamped) sorts first
+        return (df["Last Updated"].astype("string") < ts).to_numpy(dtype=bool, na_value=True)
+    raise ValueError(f"Unknown filter predicate: {kind}")
+
+def filter_mask(
+    df: pd.DataFrame, version: int, predicates: Iterable[tuple], matches: Optional[np.ndarray] = None
+) -> Optional[np.ndarray]:
+    """
+    AND of 'predicates' (and the search mask 'matches') over 'df', the inventory at data 'version';
+    None when nothing is filtered. Each predicate's mask is memoized per version, so changing one
+    filter only evaluates that one.
+    """
+    mask = matches
+    for predicate in predicates:
+        hit = memo(version, "predicate", predicate, lambda: predicate_mask(df, predicate))
+        mask = hit if mask is None else mask & hit
+    return mask
+
+def editor_view(
+    df: pd.DataFrame,
+    version: int,
+    predicates: tuple,
+    matches: Optional[np.ndarray],
+    scores: Optional[np.ndarray],
+    order: np.ndarray,
+) -> pd.DataFrame:
+    """
+    Filtered + sorted frame handed to the data editor (our columns first, extras kept). 'order' is
+    the inventory_order() permutation; with fuzzy search 'scores' (over 'df') the best matches come
+    first and the sort only breaks ties.
+    """
+    mask = filter_mask(df, version, predicates, matches)
+    if mask is not None:
+        order = order[mask[order]]
+    if scores is not None:
+        order = order[np.argsort(-scores[order], kind="stable")]
+    view_df = df.take(order).reset_index(drop=True)
+    leading_show = [ROW_ID_COL, DELETE_COL] + [c for c in USER_COLUMNS]
+    extras_show = [c for c in view_df.columns if c not in leading_show]
+    view_df = view_df[leading_show + extras_show]
+    # Plain text in the editor: a categorical column would become a selectbox limited to known values
+    cats = [c for c in CATEGORICAL_COLS if isinstance(view_df[c].dtype, pd.CategoricalDtype)]
+    return view_df.astype({c: "string" for c in cats}) if cats else view_df
+
+def downcast_numeric(s: pd.Series, decimals: Optional[int] = None) -> pd.Series:
+    """
+    int64 -> int32 when every value fits, float64 -> float32 when every value reads back the same
+    (rounded to 'decimals' places, else exactly); anything else is returned unchanged.
+    """
+    values = s.to_numpy()
+    if s.dtype == np.int64:
+        info = np.iinfo(np.int32)
+        if not len(values) or (values.min() >= info.min and values.max() <= info.max):
+            return s.astype(np.int32)
+    elif s.dtype == np.float64:
+        with np.errstate(over="ignore"):
+            back = values.astype(np.float32).astype(np.float64)
+        if decimals is not None:
+            back, values = np.round(back, decimals), np.round(values, decimals)
+        if np.array_equal(back, values, equal_nan=True):
+            return s.astype(np.float32)
+    return s
+
+def editor_payload(view_df: pd.DataFrame, columns: Iterable[str]) -> pd.DataFrame:
+    """
+    What is actually sent to the browser for (a window of) editor_view(): only 'columns' plus the
+    Delete? box, numbers downcast where the shown value doesn't change, and the read-only columns
+    dictionary-encoded. Rows stay in 'view_df' order, so merge_edits reads the delta against
+    'view_df' itself (full precision, with _row_id).
+    """
+    shown = set(columns) | {DELETE_COL}
+    out = view_df[[c for c in view_df.columns if c in shown]]
+    # Unit Cost is shown (and edited) to cents
+    cast = {c: downcast_numeric(out[c], 2 if c in FLOAT_COLS else None) for c in out.columns if out[c].dtype.kind in "if"}
+    # Editable text stays plain: a categorical column would become a selectbox limited to known values
+    cast.update({c: as_categorical(out[c]) for c in EDITOR_READONLY if c in out.columns})
+    return out.assign(**cast)
+
+# -------------------- APPLY EDITS PRECISELY -------------------
+
+def coerce_value(col: str, value):
+    """Coerce a single edited cell the same way coerce_schema (+ the no-negatives rule) treats its column."""
+    if col in INT_COLS:
+        num = pd.to_numeric(pd.Series([value]), errors="coerce").iloc[0]
+        return 0 if pd.isna(num) else max(int(num), 0)
+    if col in FLOAT_COLS:
+        num = pd.to_numeric(pd.Series([value]), errors="coerce").iloc[0]
+        return 0.0 if pd.isna(num) else max(float(num), 0.0)
+    if col in STRING_COLS:
+        return "" if value is None or pd.isna(value) else str(value).strip()
+    return value
+
+def same_value(old, new) -> bool:
+    if pd.isna(old) and pd.isna(new):
+        return True
+    try:
+        return bool(old == new)
+    except TypeError:
+        return False
+
+def merge_edits(
+    base_df: pd.DataFrame, overlay: dict, display_before: pd.DataFrame, delta: Optional[dict], changes: Optional[dict] = None
+) -> Tuple[dict, bool]:
+    """
+    Apply the data_editor delta (edited_rows / added_rows / deleted_rows) to the session 'overlay' on top
+    of the shared 'base_df', using the stable hidden ROW_ID_COL. Delta positions refer to 'display_before',
+    so this works even when a filter/sort/page was active; the editor may show a projection of it
+    (editor_payload), edited values are coerced back to the full-precision column types. Only touched
+    rows are copied into the overlay (with a fresh "Last Updated"); neither input is mutated, and an
+    empty delta is free.
+    Returns the new overlay and whether any value actually changed; the changed row ids are
+    recorded into 'changes' (see record_changes).
+    """
+    if not delta:
+        return overlay, False
+    edited_rows = delta.get("edited_rows") or {}
+    added_rows = delta.get("added_rows") or []
+    deleted_rows = delta.get("deleted_rows") or []
+    if not (edited_rows or added_rows or deleted_rows):
+        return overlay, False
+    changed = False
+    if changes is None:
+        changes = new_change_set()
+
+    view_ids = display_before[ROW_ID_COL]
+
+    # 1) DELETE rows ticked in the editor or removed with the editor's row toolbar
+    to_delete = {view_ids.iat[int(pos)] for pos in deleted_rows}
+    to_delete.update(view_ids.iat[int(pos)] for pos, cells in edited_rows.items() if cells.get(DELETE_COL))
+    if to_delete:
+        in_overlay = [rid for rid in to_delete if rid in overlay["rows"].index]
+        in_base = set(base_df.loc[base_df[ROW_ID_COL].isin(to_delete), ROW_ID_COL]) - overlay["deleted"]
+        if in_overlay or in_base:
+            overlay = {"rows": overlay["rows"].drop(index=in_overlay), "deleted": overlay["deleted"] | in_base}
+            record_changes(changes, deleted=set(in_overlay) | in_base)
+            changed = True
+
+    # 2) UPDATE touched cells only (match by _row_id)
+    updates = {}
+    for pos, cells in edited_rows.items():
+        rid = view_ids.iat[int(pos)]
+        if rid in to_delete:
+            continue
+        for col, value in cells.items():
+            if col in base_df.columns and col not in (ROW_ID_COL, DELETE_COL):
+                updates.setdefault(rid, {})[col] = coerce_value(col, value)
+    if updates:
+        # Current version of each touched row: the overlay's copy, else the base row
+        rows = overlay["rows"]
+        current = rows.loc[[rid for rid in updates if rid in rows.index]]
+        fresh = [rid for rid in updates if rid not in rows.index]
+        if fresh:
+            pos = pd.Index(base_df[ROW_ID_COL]).get_indexer(fresh)
+            fetched = by_row_id(base_df.iloc[pos[pos >= 0]])
+            current = pd.concat([current, fetched]) if len(current) else fetched
+        # New Category/Location/UOM values join the category sets first
+        current, _ = unify_categories(current, pd.DataFrame(list(updates.values())))
+        current = current.copy()
+        edited = []
+        for rid, cells in updates.items():
+            if rid not in current.index:
+                continue  # no longer exists
+            for col, value in cells.items():
+                # Skip cells the user re-typed with the same value
+                if not same_value(current.at[rid, col], value):
+                    current.at[rid, col] = value
+                    if not edited or edited[-1] != rid:
+                        edited.append(rid)
+        if edited:
+            # Stamped in the overlay too, so later full writes (after autosave took the change set) keep it
+            current.loc[edited, "Last Updated"] = ts_now()
+            overlay = overlay_upsert(overlay, current.loc[edited])
+            record_changes(changes, updated=edited)
+            changed = True
+
+    # 3) APPEND new rows (added by the user in the editor's last empty row)
+    if added_rows:
+        new_rows = pd.DataFrame(added_rows)
+        new_rows = new_rows[[c for c in new_rows.columns if c in base_df.columns and c != ROW_ID_COL]]
+        new_rows[ROW_ID_COL] = new_row_ids(len(new_rows), base_df[ROW_ID_COL])
+        new_rows = coerce_schema(new_rows)
+        # Minimum info to keep a row: Item Code or Description
+        keep_mask = (new_rows["Item Code"].str.len() > 0) | (new_rows["Description"].str.len() > 0)
+        new_rows = new_rows[keep_mask]
+        if not new_rows.empty:
+            # Enforce no negative numbers (already handled by editor, but just in case)
+            for c in INT_COLS:
+                new_rows[c] = new_rows[c].clip(lower=0)
+            new_rows["Unit Cost (ZAR)"] = new_rows["Unit Cost (ZAR)"].clip(lower=0.0)
+            new_rows["Last Updated"] = ts_now()
+            overlay = overlay_upsert(overlay, new_rows.reindex(columns=base_df.columns))
+            record_changes(changes, inserted=new_rows[ROW_ID_COL])
+            changed = True
+
+    return overlay, changed
 
 # ------------------------- STATE ------------------------------
 
 st.set_page_config(page_title=APP_TITLE, page_icon="📦", layout="wide")
 ensure_dirs()
 
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex  # keys this session's autosave jobs
 if "data_path" not in st.session_state:
     st.session_state.data_path = DEFAULT_DATA_PATH
-if "df" not in st.session_state:
-    st.session_state.df = coerce_schema(read_any(st.session_state.data_path))
+if "base" not in st.session_state:
+    st.session_state.base, st.session_state.base_version = load_inventory(st.session_state.data_path)
+    st.session_state.data_version = st.session_state.base_version
+if "overlay" not in st.session_state:
+    st.session_state.overlay = new_overlay(st.session_state.base)
 if "sort_cols" not in st.session_state:
     st.session_state.sort_cols = DEFAULT_SORT
 if "sort_asc" not in st.session_state:
@@ -193,6 +1604,166 @@ if "autosave" not in st.session_state:
     st.session_state.autosave = False
 if "dirty" not in st.session_state:
     st.session_state.dirty = False
+if "changes" not in st.session_state:
+    st.session_state.changes = new_change_set()
+if "saved_path" not in st.session_state:
+    st.session_state.saved_path = st.session_state.data_path  # file the change set is relative to
+if "autosave_delay" not in st.session_state:
+    st.session_state.autosave_delay = AUTOSAVE_DELAY_S
+if "journal" not in st.session_state:
+    st.session_state.journal = JOURNAL_DEFAULT
+
+# ------------------------ CALLBACKS ---------------------------
+
+def session_inventory() -> Tuple[int, pd.DataFrame]:
+    """(data version, current inventory) of this session."""
+    version = st.session_state.data_version
+    return version, current_inventory(st.session_state.base, st.session_state.overlay, version)
+
+def session_aggregates() -> dict:
+    return current_aggregates(
+        st.session_state.base, st.session_state.overlay, st.session_state.base_version, st.session_state.data_version
+    )
+
+def session_sort_key() -> tuple:
+    return (tuple(st.session_state.sort_cols), st.session_state.sort_asc)
+
+def current_order() -> np.ndarray:
+    version, current_df = session_inventory()
+    return inventory_order(
+        current_df,
+        st.session_state.base,
+        st.session_state.overlay,
+        st.session_state.base_version,
+        version,
+        st.session_state.sort_cols,
+        st.session_state.sort_asc,
+    )
+
+def sorted_inventory() -> pd.DataFrame:
+    """Current inventory in the sidebar sort order, shared by autosave, save and export."""
+    version, current_df = session_inventory()
+    return memo(version, "sorted", session_sort_key(), lambda: current_df.take(current_order()).reset_index(drop=True))
+
+def queue_autosave() -> None:
+    """If autosave is on, hand unsaved changes to the background writer (debounced, never blocks the render)."""
+    if not (st.session_state.autosave and st.session_state.dirty):
+        return
+    # A different target file has none of this session's rows yet: it is written in full
+    same_store = st.session_state.data_path == st.session_state.saved_path
+    get_autosave_worker().submit(
+        st.session_state.session_id,
+        sorted_inventory(),
+        st.session_state.data_path,
+        st.session_state.autosave_delay,
+        st.session_state.changes,
+        st.session_state.journal and same_store,
+        same_store,
+    )
+    st.session_state.dirty = False
+    st.session_state.changes = new_change_set()
+    st.session_state.saved_path = st.session_state.data_path
+
+def data_changed() -> None:
+    """The session overlay changed: new data version, then autosave."""
+    st.session_state.dirty = True
+    st.session_state.data_version = next_data_version()
+    queue_autosave()
+
+def apply_editor_edits() -> None:
+    """data_editor on_change: merge the delta into the overlay before anything reruns."""
+    st.session_state.overlay, changed = merge_edits(
+        st.session_state.base,
+        st.session_state.overlay,
+        st.session_state.editor_window,
+        st.session_state.get(EDITOR_KEY),
+        st.session_state.changes,
+    )
+    if changed:
+        data_changed()
+        # Metrics and facet counts follow the data (otherwise only the inventory view reruns)
+        st.rerun(DATA_FRAGMENTS)
+
+def sort_changed() -> None:
+    st.session_state.sort_cols = st.session_state.sort_by
+    st.session_state.sort_asc = st.session_state.sort_dir == "Ascending"
+    # Only the inventory view depends on the sort
+    st.rerun("inventory")
+
+def clear_filters() -> None:
+    for key, value in FILTER_DEFAULTS.items():
+        st.session_state[key] = value
+
+def jump_to_row() -> None:
+    row, size = st.session_state.editor_jump, st.session_state.editor_page_size
+    if row and size:
+        st.session_state.editor_page = (int(row) - 1) // size + 1
+
+def save_inventory() -> None:
+    """💾 Save: write the session's inventory; the outcome is shown by the inventory view."""
+    try:
+        path = st.session_state.data_path
+        # This save supersedes a pending autosave (even if autosave was turned off since, or it would
+        # land after this save), but must still stamp the rows it carried
+        pending = get_autosave_worker().discard(st.session_state.session_id, path)
+        if (
+            pending is None
+            and not has_changes(st.session_state.changes)
+            and path == st.session_state.saved_path
+            and os.path.exists(path)
+        ):
+            st.session_state.notice = ("info", "No changes to save.", None)
+            return
+        # Update Last Updated on changed rows (handled inside write_any)
+        sorted_df = sorted_inventory()
+        sort_key = session_sort_key()
+        # A different target file has none of this session's rows yet (nor has one a pending
+        # autosave was still to write in full): write it in full
+        same_store = path == st.session_state.saved_path
+        changes = st.session_state.changes
+        if pending is not None:
+            changes = combine_changes(pending[0], changes)
+            same_store = same_store and pending[1]
+        journal = st.session_state.journal and same_store
+        saved_df, checksum = write_any(sorted_df, path, changes, journal, same_store)
+        # The written frame is what the store holds only after a full write nobody else followed
+        adopt = saved_df is not None and store_checksum(path) == checksum
+        if adopt:
+            # Other sessions reloading this file version get the frame without parsing it
+            st.session_state.base, st.session_state.base_version = cache_inventory(storage_key(path), saved_df)
+        else:
+            # Row-level write (the store keeps other sessions' rows) or another writer; trust the disk
+            st.session_state.base, st.session_state.base_version = load_inventory(path)
+        st.session_state.overlay = new_overlay(st.session_state.base)
+        st.session_state.data_version = version = st.session_state.base_version
+        if adopt:
+            # The saved frame was written in this sort order
+            memo(version, "sort_order", sort_key, lambda: np.arange(len(saved_df.index)))
+        st.session_state.dirty = False
+        st.session_state.changes = new_change_set()
+        st.session_state.saved_path = path
+        st.session_state.notice = ("success", "Saved successfully.", None)
+    except Exception as e:
+        st.session_state.notice = ("error", f"Save failed: {e}", None)
+    # What is on disk may differ from what was shown (another writer)
+    st.rerun(DATA_FRAGMENTS)
+
+def rebuild_item_ids() -> None:
+    """Generate an Item ID for blank entries (optional field)."""
+    _, current_df = session_inventory()
+    if "Item ID" not in current_df.columns:
+        st.session_state.notice = ("info", "Column 'Item ID' not present; nothing to rebuild.", None)
+        return
+    needs = current_df["Item ID"].astype(str).str.len() == 0
+    if needs.any():
+        stamp = datetime.now().strftime("%y%m%d%H%M%S")
+        fixed = current_df[needs].copy()
+        fixed.loc[:, "Item ID"] = [f"OPW-{stamp}-{seq:03d}" for seq in range(1, len(fixed) + 1)]
+        fixed.loc[:, "Last Updated"] = ts_now()
+        record_changes(st.session_state.changes, updated=fixed[ROW_ID_COL])
+        st.session_state.overlay = overlay_upsert(st.session_state.overlay, fixed)
+        data_changed()
+        st.session_state.notice = ("toast", "Item IDs generated.", "🆔")
 
 # -------------------------- SIDEBAR ---------------------------
 
@@ -210,7 +1781,7 @@ with st.sidebar:
     st.markdown("---")
     st.markdown("### Data Source")
     st.session_state.data_path = st.text_input(
-        "Inventory file path (.csv or .xlsx)",
+        "Inventory file path (.csv, .xlsx, .parquet, .feather or .db)",
         value=st.session_state.data_path,
         help="Choose a shared path if multiple users edit."
     )
@@ -218,28 +1789,62 @@ with st.sidebar:
     c1, c2 = st.columns(2)
     with c1:
         if st.button("Load / Reload", use_container_width=True):
-            st.session_state.df = coerce_schema(read_any(st.session_state.data_path))
+            st.session_state.base, st.session_state.base_version = load_inventory(st.session_state.data_path)
+            st.session_state.data_version = st.session_state.base_version
+            st.session_state.overlay = new_overlay(st.session_state.base)
             st.session_state.dirty = False
+            st.session_state.changes = new_change_set()
+            st.session_state.saved_path = st.session_state.data_path
             st.toast("Inventory loaded.", icon="✅")
     with c2:
         if st.button("Snapshot CSV", help="Write a timestamped CSV to /snapshots", use_container_width=True):
             snap_path = os.path.join(
                 SNAPSHOT_DIR, f"inventory_snapshot_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
             )
-            st.session_state.df.to_csv(snap_path, index=False)
+            materialize(st.session_state.base, st.session_state.overlay).to_csv(snap_path, index=False)
             st.success(f"Snapshot saved: {snap_path}")
 
     st.markdown("---")
     st.session_state.autosave = st.toggle("Autosave after edits", value=st.session_state.autosave)
+    if st.session_state.autosave:
+        st.session_state.autosave_delay = st.number_input(
+            "Autosave delay (s)",
+            min_value=0.0,
+            max_value=60.0,
+            step=0.5,
+            value=float(st.session_state.autosave_delay),
+            help="Edits are coalesced and written once nothing has changed for this long.",
+        )
+        last_autosave = get_autosave_worker().last_saved.get(st.session_state.data_path)
+        if last_autosave:
+            st.caption(f"Last autosave: {last_autosave}")
+    st.session_state.journal = st.toggle(
+        "Journal saves",
+        value=st.session_state.journal,
+        help="Append only the changed rows to a journal next to the file; it is folded back into the file "
+        "once it grows large. Retired journals are kept in /backups as an audit trail.",
+    )
 
     st.markdown("---")
     st.markdown("### Sort")
-    st.session_state.sort_cols = st.multiselect(
+    st.multiselect(
         "Sort by (top to bottom priority)",
         options=[c for c in USER_COLUMNS if c != "Last Updated"],
         default=st.session_state.sort_cols,
+        key="sort_by",
+        on_change=sort_changed,
     )
-    st.session_state.sort_asc = st.radio("Direction", ["Ascending", "Descending"], index=0, horizontal=True) == "Ascending"
+    st.radio(
+        "Direction",
+        ["Ascending", "Descending"],
+        index=0 if st.session_state.sort_asc else 1,
+        horizontal=True,
+        key="sort_dir",
+        on_change=sort_changed,
+    )
+
+# Turning autosave on hands over the edits made so far
+queue_autosave()
 
 # -------------------------- HEADER ----------------------------
 
@@ -250,190 +1855,223 @@ with left:
 with mid:
     st.title(APP_TITLE)
     st.caption("Edit inline. Rename, change quantities, add new rows, or delete rows — then Save.")
-with right:
-    base_df = st.session_state.df
-    total_items = len(base_df.index)
-    total_qty = int(base_df["Qty On Hand"].sum())
-    stock_value = float((base_df["Qty On Hand"] * base_df["Unit Cost (ZAR)"]).sum())
-    st.metric("Items", f"{total_items:,}")
-    st.metric("Total Qty", f"{total_qty:,}")
-    st.metric("Stock Value (R)", f"{stock_value:,.2f}")
 
-# ----------------------- FILTERS & VIEW -----------------------
+@st.fragment(key="metrics")
+def header_metrics() -> None:
+    totals = session_aggregates()["total"]
+    st.metric("Items", f"{int(totals['Items']):,}")
+    st.metric("Total Qty", f"{int(totals['Total Qty']):,}")
+    st.metric("Stock Value (R)", f"{totals['Stock Value']:,.2f}")
+
+@st.fragment(key="breakdown")
+def stock_breakdown() -> None:
+    aggregates = session_aggregates()
+    with st.expander("📊 Breakdown", expanded=False):
+        bcols = st.columns(len(METRIC_GROUPS))
+        for bcol, col in zip(bcols, METRIC_GROUPS):
+            with bcol:
+                st.dataframe(
+                    aggregates[col],
+                    use_container_width=True,
+                    column_config={
+                        "Items": st.column_config.NumberColumn(format="%d"),
+                        "Total Qty": st.column_config.NumberColumn(format="%d"),
+                        "Stock Value": st.column_config.NumberColumn("Stock Value (R)", format="%.2f"),
+                    },
+                )
 
-with st.expander("🔎 Filters", expanded=False):
-    fcols = st.columns([1, 1, 1, 2])
-    with fcols[0]:
-        f_cat = st.multiselect("Category", sorted([c for c in base_df["Category"].unique() if c]))
-    with fcols[1]:
-        f_loc = st.multiselect("Location", sorted([c for c in base_df["Location"].unique() if c]))
-    with fcols[2]:
-        f_uom = st.multiselect("UOM", sorted([c for c in base_df["UOM"].unique() if c]))
-    with fcols[3]:
-        q = st.text_input("Search (Code / Description)")
-
-view_df = base_df.copy()
-if f_cat:
-    view_df = view_df[view_df["Category"].isin(f_cat)]
-if f_loc:
-    view_df = view_df[view_df["Location"].isin(f_loc)]
-if f_uom:
-    view_df = view_df[view_df["UOM"].isin(f_uom)]
-if q.strip():
-    qq = q.strip().lower()
-    view_df = view_df[
-        view_df["Item Code"].str.lower().str.contains(qq, na=False)
-        | view_df["Description"].str.lower().str.contains(qq, na=False)
-    ]
-
-# Apply sort for display
-view_df = apply_sort(view_df, st.session_state.sort_cols, st.session_state.sort_asc)
-
-st.markdown("### Inventory")
-st.caption(
-    "• Double-click to edit cells.  • Use the last empty row to add items.  • Tick **Delete?** to mark rows for deletion."
-)
-
-# Ensure editor includes only relevant columns (keep extras but show ours first)
-leading_show = [ROW_ID_COL, DELETE_COL] + [c for c in USER_COLUMNS]
-extras_show = [c for c in view_df.columns if c not in leading_show]
-editor_df = view_df[leading_show + extras_show].copy()
-
-edited_df = st.data_editor(
-    editor_df,
-    key="inventory_editor_v2",
-    use_container_width=True,
-    num_rows="dynamic",
-    column_config={
-        ROW_ID_COL: st.column_config.TextColumn(label="row id", disabled=True),
-        DELETE_COL: st.column_config.CheckboxColumn(label="Delete?"),
-        "Qty On Hand": st.column_config.NumberColumn(format="%d", step=1, min_value=0),
-        "Min Level": st.column_config.NumberColumn(format="%d", step=1, min_value=0),
-        "Max Level": st.column_config.NumberColumn(format="%d", step=1, min_value=0),
-        "Unit Cost (ZAR)": st.column_config.NumberColumn(format="%.2f", step=0.10, min_value=0.0),
-        "Last Updated": st.column_config.TextColumn(disabled=True),
-    },
-)
+with right:
+    header_metrics()
+stock_breakdown()
 
-# -------------------- APPLY EDITS PRECISELY -------------------
+# ----------------------- FILTERS & VIEW -----------------------
 
-def merge_edits(master_df: pd.DataFrame, display_before: pd.DataFrame, edited_view: pd.DataFrame) -> pd.DataFrame:
-    """
-    Apply edits from 'edited_view' back to 'master_df' using the stable hidden ROW_ID_COL.
-    Works even when a filter/sort was active.
-    """
-    master = master_df.copy()
+@st.fragment(key="inventory")
+def inventory_view() -> None:
+    """Filters, the editor and its actions; reruns on its own for any interaction inside it."""
+    version, current_df = session_inventory()
+
+    with st.expander("🔎 Filters", expanded=False):
+        # Counts for each facet follow the selections in the others (read from the widgets' state)
+        facets = memo(version, "facets", (), lambda: FacetIndex(current_df))
+        selections = {col: tuple(st.session_state.get(f"facet_{col}", ())) for col in FACET_COLS}
+        facet_counts = memo(version, "facet_counts", tuple(selections.items()), lambda: facets.counts(selections))
+
+        def facet_filter(col: str) -> List[str]:
+            counts = facet_counts[col]
+            options = facets.options[col] + [v for v in selections[col] if v not in facets.options[col]]
+            # Keyed, so the changing count labels don't reset the selection
+            return st.multiselect(col, options, key=f"facet_{col}", format_func=lambda v: f"{v} ({counts.get(v, 0):,})")
+
+        fcols = st.columns([1, 1, 1, 2])
+        with fcols[0]:
+            f_cat = facet_filter("Category")
+        with fcols[1]:
+            f_loc = facet_filter("Location")
+        with fcols[2]:
+            f_uom = facet_filter("UOM")
+        with fcols[3]:
+            q = st.text_input("Search (Code / Description)", key="filter_search")
+            fuzzy = st.toggle(
+                "Fuzzy match",
+                key="filter_fuzzy",
+                help="Rank by similarity; tolerates typos and abbreviations (e.g. 'galv bolt')",
+            )
 
-    # Ensure schema/dtypes
-    edited = coerce_schema(edited_view.drop(columns=[c for c in edited_view.columns if c not in master.columns], errors="ignore"))
-    master = coerce_schema(master)
+        ncols = st.columns(6)
+        with ncols[0]:
+            qty_lo = st.number_input("Qty ≥", min_value=0, value=None, step=1, key="filter_qty_lo")
+        with ncols[1]:
+            qty_hi = st.number_input("Qty ≤", min_value=0, value=None, step=1, key="filter_qty_hi")
+        with ncols[2]:
+            cost_lo = st.number_input("Unit Cost ≥", min_value=0.0, value=None, step=1.0, key="filter_cost_lo")
+        with ncols[3]:
+            cost_hi = st.number_input("Unit Cost ≤", min_value=0.0, value=None, step=1.0, key="filter_cost_hi")
+        with ncols[4]:
+            stock_status = st.selectbox("Stock level", ["Any", "Below Min Level", "Above Max Level"], key="filter_stock")
+        with ncols[5]:
+            stale_days = st.number_input("Not updated in (days)", min_value=1, value=None, step=1, key="filter_stale_days")
+
+    # Filtered + sorted view for display (recomputed only when the data or the view parameters change)
+    filters = [("in", col, tuple(values)) for col, values in zip(FACET_COLS, (f_cat, f_loc, f_uom)) if values]
+    for col, lo, hi in (("Qty On Hand", qty_lo, qty_hi), ("Unit Cost (ZAR)", cost_lo, cost_hi)):
+        if lo is not None or hi is not None:
+            filters.append(("range", col, lo, hi))
+    if stock_status == "Below Min Level":
+        filters.append(("below_min",))
+    elif stock_status == "Above Max Level":
+        filters.append(("above_max",))
+    if stale_days:
+        # Day granularity keeps the predicate (and its cached mask) stable within a day
+        cutoff = (datetime.now() - timedelta(days=int(stale_days))).strftime("%Y-%m-%d")
+        filters.append(("updated_before", cutoff))
+    filters = tuple(filters)
+    query = q.strip().lower()
+    sort_key = session_sort_key()
+
+    def search_view() -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """(match mask, fuzzy scores) over current_df for the search box."""
+        if not query:
+            return None, None
+        args = (current_df, st.session_state.base, st.session_state.overlay, st.session_state.base_version, query)
+        if fuzzy:
+            scores = memo(version, "fuzzy", (query,), lambda: fuzzy_scores(*args))
+            return scores >= FUZZY_MIN_SCORE, scores
+        return memo(version, "search", (query,), lambda: search_matches(*args)), None
+
+    view_key = filters + (query, fuzzy) + sort_key
+    editor_df = memo(
+        version,
+        "editor_view",
+        view_key,
+        lambda: editor_view(current_df, version, filters, *search_view(), current_order()),
+    )
 
-    # 1) DELETE rows ticked in the editor (only those present in the edited view)
-    to_delete_ids = edited.loc[edited[DELETE_COL] == True, ROW_ID_COL].astype(str).tolist()
-    if to_delete_ids:
-        master = master[~master[ROW_ID_COL].astype(str).isin(to_delete_ids)].copy()
+    st.markdown("### Inventory")
+    st.caption(
+        "• Double-click to edit cells.  • Use the last empty row to add items.  • Tick **Delete?** to mark rows for deletion."
+    )
 
-    # 2) UPDATE existing rows (match by _row_id)
-    existing = edited[(edited[ROW_ID_COL].astype(str).str.len() > 0) & (~edited[ROW_ID_COL].isna())].copy()
-    existing = existing.drop(columns=[DELETE_COL], errors="ignore")
+    # Paging: only the visible window is sent to the editor; its delta maps back through _row_id
+    total_rows = len(editor_df)
+    pcols = st.columns([1, 1, 1, 3, 2])
+    with pcols[0]:
+        page_size = st.selectbox(
+            "Rows per page",
+            EDITOR_PAGE_SIZES,
+            index=EDITOR_PAGE_SIZES.index(EDITOR_PAGE_SIZE),
+            format_func=lambda n: f"{n:,}" if n else "All",
+            key="editor_page_size",
+        )
+    page_count = max(-(-total_rows // page_size), 1) if page_size else 1
+    # A filter (or page size) change can leave the remembered page past the end
+    if st.session_state.get("editor_page", 1) > page_count:
+        st.session_state.editor_page = page_count
+    with pcols[1]:
+        page = st.number_input(
+            f"Page (of {page_count:,})", min_value=1, max_value=page_count, step=1, key="editor_page", disabled=page_count == 1
+        )
+    with pcols[2]:
+        st.number_input(
+            "Jump to row", min_value=1, max_value=max(total_rows, 1), value=None, step=1, key="editor_jump", on_change=jump_to_row
+        )
+    start = (int(page) - 1) * page_size if page_size else 0
+    stop = min(start + page_size, total_rows) if page_size else total_rows
+    window_df = editor_df.iloc[start:stop]
+    # apply_editor_edits reads the editor's delta against the window's row ids; kept as their own
+    # array, since the slice itself would keep the whole view alive in session_state
+    st.session_state.editor_window = pd.DataFrame({ROW_ID_COL: window_df[ROW_ID_COL].to_numpy(dtype=object)})
+    with pcols[3]:
+        # Columns sent to the editor (Delete? always is); edits map back to the full-precision window_df
+        column_options = [c for c in editor_df.columns if c != DELETE_COL]
+        if "editor_columns" not in st.session_state:
+            st.session_state.editor_columns = [c for c in column_options if c not in EDITOR_HIDDEN]
+        else:
+            # Extra columns come and go with the loaded file
+            st.session_state.editor_columns = [c for c in st.session_state.editor_columns if c in column_options]
+        shown_columns = st.multiselect("Columns", column_options, key="editor_columns")
+    with pcols[4]:
+        st.caption(f"Rows {start + 1 if stop else 0:,}–{stop:,} of {total_rows:,}")
+
+    st.data_editor(
+        memo(version, "editor_payload", view_key + (start, stop, tuple(shown_columns)), lambda: editor_payload(window_df, shown_columns)),
+        key=EDITOR_KEY,
+        on_change=apply_editor_edits,
+        use_container_width=True,
+        num_rows="dynamic",
+        column_config={
+            ROW_ID_COL: st.column_config.TextColumn(label="row id", disabled=True),
+            DELETE_COL: st.column_config.CheckboxColumn(label="Delete?"),
+            "Qty On Hand": st.column_config.NumberColumn(format="%d", step=1, min_value=0),
+            "Min Level": st.column_config.NumberColumn(format="%d", step=1, min_value=0),
+            "Max Level": st.column_config.NumberColumn(format="%d", step=1, min_value=0),
+            "Unit Cost (ZAR)": st.column_config.NumberColumn(format="%.2f", step=0.10, min_value=0.0),
+            "Last Updated": st.column_config.TextColumn(disabled=True),
+        },
+    )
 
-    if not existing.empty:
-        m_idx = master.set_index(ROW_ID_COL)
-        e_idx = existing.set_index(ROW_ID_COL)
+    # Buttons
+    c_a, c_b, c_c, c_d = st.columns([1, 1, 1, 1])
+    with c_a:
+        st.button("💾 Save", type="primary", on_click=save_inventory, use_container_width=True)
+    with c_b:
+        export_clicked = st.button("⬇️ Export Excel", use_container_width=True)
+    with c_c:
+        st.button("🔁 Clear Filters", on_click=clear_filters, use_container_width=True)
+    with c_d:
+        st.button(
+            "🆔 Rebuild Missing IDs",
+            help="Generate Item ID for blank entries",
+            on_click=rebuild_item_ids,
+            use_container_width=True,
+        )
 
-        # Align columns
-        use_cols = [c for c in e_idx.columns if c in m_idx.columns]
-        m_idx.update(e_idx[use_cols])
-        master = m_idx.reset_index()
+    # Outcome of a save / rebuild callback (callbacks can't draw into a fragment themselves)
+    notice = st.session_state.pop("notice", None)
+    if notice:
+        kind, message, icon = notice
+        getattr(st, kind)(message, icon=icon)
 
-    # 3) APPEND new rows (those without _row_id got added by the user in the editor)
-    new_rows = edited[(edited[ROW_ID_COL].isna()) | (edited[ROW_ID_COL].astype(str).str.len() == 0)].copy()
-    if not new_rows.empty:
-        # Minimum info to keep a row: Item Code or Description
-        keep_mask = (new_rows["Item Code"].astype(str).str.len() > 0) | (new_rows["Description"].astype(str).str.len() > 0)
-        new_rows = new_rows[keep_mask].copy()
-        if not new_rows.empty:
-            # Generate row ids
-            new_ids = [f"opw_{uuid.uuid4().hex}" for _ in range(len(new_rows))]
-            new_rows[ROW_ID_COL] = new_ids
-            new_rows[DELETE_COL] = False
-            master = pd.concat([master, new_rows.reindex(columns=master.columns, fill_value="")], ignore_index=True)
-
-    # Basic sanitation
-    master = coerce_schema(master)
-
-    # 4) Optional: enforce no negative numbers (already handled by editor, but just in case)
-    for c in INT_COLS:
-        master[c] = master[c].clip(lower=0)
-    master["Unit Cost (ZAR)"] = master["Unit Cost (ZAR)"].clip(lower=0.0)
-
-    return master
-
-# Buttons
-c_a, c_b, c_c, c_d = st.columns([1, 1, 1, 1])
-with c_a:
-    save_clicked = st.button("💾 Save", type="primary", use_container_width=True)
-with c_b:
-    export_clicked = st.button("⬇️ Export Excel", use_container_width=True)
-with c_c:
-    clear_filters = st.button("🔁 Clear Filters", use_container_width=True)
-with c_d:
-    rebuild_ids = st.button("🆔 Rebuild Missing IDs", help="Generate Item ID for blank entries", use_container_width=True)
-
-if clear_filters:
-    st.experimental_rerun()
-
-# Merge live edits into session master DF
-st.session_state.df = merge_edits(st.session_state.df, editor_df, edited_df)
-
-# If autosave, persist immediately after merge
-if st.session_state.autosave:
-    try:
-        write_any(apply_sort(st.session_state.df, st.session_state.sort_cols, st.session_state.sort_asc), st.session_state.data_path)
-        st.toast("Autosaved.", icon="💾")
-    except Exception as e:
-        st.error(f"Autosave failed: {e}")
+    if st.session_state.autosave:
+        autosave_error = get_autosave_worker().last_error.get(st.session_state.data_path)
+        if autosave_error:
+            st.error(f"Autosave failed: {autosave_error}")
 
-# Manual save
-if save_clicked:
-    try:
-        # Update Last Updated now (handled inside write_any)
-        sorted_df = apply_sort(st.session_state.df, st.session_state.sort_cols, st.session_state.sort_asc)
-        write_any(sorted_df, st.session_state.data_path)
-        st.session_state.df = coerce_schema(read_any(st.session_state.data_path))  # re-read for absolute certainty
-        st.success("Saved successfully.")
-    except Exception as e:
-        st.error(f"Save failed: {e}")
+    # Export: the workbook is only built when the download is clicked (on Streamlit's own thread)
+    if export_clicked:
+        try:
+            export_df = sorted_inventory()
+            st.download_button(
+                "Download Inventory.xlsx",
+                data=lambda: export_excel_bytes(export_df),
+                file_name=f"Inventory_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                use_container_width=True,
+            )
+        except Exception as e:
+            st.error(f"Export failed: {e}")
 
-# Export
-if export_clicked:
-    try:
-        bin_xlsx = export_excel_bytes(apply_sort(st.session_state.df, st.session_state.sort_cols, st.session_state.sort_asc))
-        st.download_button(
-            "Download Inventory.xlsx",
-            data=bin_xlsx,
-            file_name=f"Inventory_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            use_container_width=True,
-        )
-    except Exception as e:
-        st.error(f"Export failed: {e}")
-
-# Rebuild Item ID helper (optional field)
-if rebuild_ids:
-    df = st.session_state.df.copy()
-    if "Item ID" in df.columns:
-        needs = df["Item ID"].astype(str).str.len() == 0
-        if needs.any():
-            stamp = datetime.now().strftime("%y%m%d%H%M%S")
-            seq = 1
-            for i in df.index[needs]:
-                df.at[i, "Item ID"] = f"OPW-{stamp}-{seq:03d}"
-                seq += 1
-            st.session_state.df = df
-            st.toast("Item IDs generated.", icon="🆔")
-    else:
-        st.info("Column 'Item ID' not present; nothing to rebuild.")
+inventory_view()
 
 st.markdown("---")
 st.caption("© OpperWorks — Stable inline editing with precise updates, deletes, reordering, backups, and snapshots.")